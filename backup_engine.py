@@ -1,4 +1,6 @@
 import os
+import posixpath
+import sys
 import shutil
 import psutil
 import hashlib
@@ -6,15 +8,1744 @@ import threading
 import time
 import platform
 import subprocess
+import sqlite3
+import json
+import errno
+import random
+import bisect
+import tarfile
+import io
+import gzip
+import zlib
+import tempfile
+from array import array
+from collections import deque
+from queue import Queue, Empty, Full
 from pathlib import Path
 
+
+class ExclusionMatcher:
+    """
+    Exclusions and exceptions compiled once per scan.
+    Same semantics as the old per-call loop in BackupEngine._is_excluded,
+    but each check is a handful of set/prefix lookups.
+    """
+    def __init__(self, exclusions, exceptions=None):
+        if exceptions is None:
+            exceptions = []
+
+        # Prefix rules: lowercase string prefixes (tree exclusion).
+        # str.startswith with a tuple scans all prefixes in C.
+        self.prefixes = tuple(str(excl).lower() for excl in exclusions)
+
+        # Name rules: bare folder names matching any path part (e.g. 'Windows' anywhere)
+        self.names = frozenset(
+            str(excl).lower() for excl in exclusions
+            if os.sep not in str(excl) and '/' not in str(excl)
+        )
+
+        # Exceptions and all their ancestors, normalized like Path does.
+        # Windows paths compare case-insensitively, POSIX ones do not.
+        self.exceptions = set()
+        self.exception_ancestors = set()
+        for exc in exceptions:
+            exc_path = Path(exc)
+            self.exceptions.add(self._key(str(exc_path)))
+            self.exception_ancestors.add(self._key(str(exc_path)))
+            for parent in exc_path.parents:
+                self.exception_ancestors.add(self._key(str(parent)))
+
+    @staticmethod
+    def _key(path_str):
+        return path_str.lower() if os.name == 'nt' else path_str
+
+    @staticmethod
+    def split_parts(path_str):
+        """Path parts of a normalized path string, without the drive/root."""
+        rest = os.path.splitdrive(path_str)[1]
+        return [part for part in rest.split(os.sep) if part]
+
+    def is_hidden_name(self, name):
+        # Dotfiles (.git, .venv) and '$' folders ($Recycle.Bin) are always excluded
+        return name[:1] in ('.', '$')
+
+    def matches_rules(self, path_str, parts=None):
+        """True if the path hits an exclusion rule (ignoring exceptions)."""
+        if path_str.lower().startswith(self.prefixes):
+            return True
+        if self.names:
+            if parts is None:
+                parts = self.split_parts(path_str)
+            for part in parts:
+                if part.lower() in self.names:
+                    return True
+        return False
+
+    def is_excepted(self, path_str):
+        """True if the path is an exception, inside one, or on the way to one."""
+        if not self.exceptions:
+            return False
+        key = self._key(path_str)
+        # Path is parent of (or equal to) an exception: we must traverse it
+        if key in self.exception_ancestors:
+            return True
+        # Path is inside an exception
+        while True:
+            parent = os.path.dirname(key)
+            if not parent:
+                return '.' in self.exceptions
+            if parent == key:
+                return False
+            if parent in self.exceptions:
+                return True
+            key = parent
+
+    def is_excluded(self, path_str, hidden=None):
+        """
+        path_str: normalized path string (as produced by str(Path(...))).
+        hidden: precomputed Windows hidden attribute, or None to stat the path.
+        """
+        parts = self.split_parts(path_str)
+        for part in parts:
+            if self.is_hidden_name(part):
+                return True
+
+        if os.name == 'nt':
+            if hidden is None:
+                hidden = _has_hidden_attribute(path_str)
+            if hidden:
+                return True
+
+        if not self.matches_rules(path_str, parts):
+            return False
+
+        return not self.is_excepted(path_str)
+
+
+def _entry_is_hidden(entry):
+    """Windows hidden attribute from a DirEntry (cached by scandir, no syscall)."""
+    try:
+        import stat
+        return bool(entry.stat().st_file_attributes & stat.FILE_ATTRIBUTE_HIDDEN)
+    except Exception:
+        return False
+
+
+# Without os.sync (Windows) every written file is fsync'ed through its own
+# write handle before it is closed (see CopyBackend, PackWriter)
+FSYNC_EACH_FILE = not hasattr(os, 'sync')
+
+
+def _flush_to_media():
+    """Writes the data of finished files, and their renames and links, to the devices."""
+    if not FSYNC_EACH_FILE:
+        os.sync()
+
+
+def _drop_page_cache(fd, flush=False):
+    """Best effort: make the next reads of fd come from the device, not RAM."""
+    try:
+        if flush:
+            os.fsync(fd)
+    except OSError:
+        pass
+    try:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        elif sys.platform == 'darwin':
+            import fcntl
+            fcntl.fcntl(fd, getattr(fcntl, 'F_NOCACHE', 48), 1)
+    except (OSError, ImportError):
+        pass
+
+
+def _has_hidden_attribute(path_str):
+    try:
+        import stat
+        attrs = os.stat(path_str).st_file_attributes
+        return bool(attrs & stat.FILE_ATTRIBUTE_HIDDEN)
+    except Exception:
+        return False
+
+
+def _shell_quote(value):
+    """Single-quotes value for the device shell (`adb shell` runs sh -c)."""
+    return "'" + value.replace("'", "'\\''") + "'"
+
+
+def _find_escape(value):
+    """Escapes the glob characters of a literal path for find -path / -name."""
+    for ch in "\\*?[":
+        value = value.replace(ch, "\\" + ch)
+    return value
+
+
+class FileRecordList:
+    """
+    Compact list of scanned file records (what scan_files returns).
+    Stored as columns instead of one dict per file: a path is kept as an
+    interned (source folder, destination folder) pair plus the file name,
+    sizes (and mtimes, when the scan has them) in arrays, and category /
+    root_label / device_id as indexes into one small table of interned
+    strings. A 3M-file scan then costs a fraction of the memory of a list of
+    dicts.
+    Iterating and indexing still give the usual record dicts
+    ('source', 'size', 'category', 'rel_path', 'root_label'[, 'device_id']
+    [, 'mtime_ns']), built on the fly; any other keys a record carries are
+    kept aside as is.
+    """
+    _SEPARATORS = "/\\" if os.sep == "\\" else "/"
+
+    def __init__(self, records=None):
+        self._folders = []        # (source folder, rel folder), both with trailing separator
+        self._folder_ids = {}
+        self._values = [None]     # interned strings; 0 = None
+        self._value_ids = {None: 0}
+        self._folder = array('I')
+        self._names = []
+        self._sizes = array('q')
+        self._mtimes = array('q')  # -1 = not known
+        self._category = array('I')
+        self._label = array('I')
+        self._device = array('I')
+        self._renamed = {}        # index -> rel name, when it differs from the source name
+        self._extra = {}          # index -> other keys
+        if records is not None:
+            self.extend(records)
+
+    def _intern(self, value):
+        value_id = self._value_ids.get(value)
+        if value_id is None:
+            value_id = len(self._values)
+            self._values.append(value)
+            self._value_ids[value] = value_id
+        return value_id
+
+    def _split(self, path):
+        cut = max(path.rfind(sep) for sep in self._SEPARATORS) + 1
+        return path[:cut], path[cut:]
+
+    def append(self, file_info):
+        source_folder, name = self._split(file_info['source'])
+        rel_folder, rel_name = self._split(file_info['rel_path'])
+        key = (source_folder, rel_folder)
+        folder_id = self._folder_ids.get(key)
+        if folder_id is None:
+            folder_id = len(self._folders)
+            self._folders.append(key)
+            self._folder_ids[key] = folder_id
+
+        index = len(self._names)
+        self._folder.append(folder_id)
+        self._names.append(name)
+        self._sizes.append(file_info['size'])
+        self._mtimes.append(file_info.get('mtime_ns', -1))
+        self._category.append(self._intern(file_info['category']))
+        self._label.append(self._intern(file_info.get('root_label', "")))
+        self._device.append(self._intern(file_info.get('device_id')))
+        if rel_name != name:
+            self._renamed[index] = rel_name
+        if len(file_info) > 5:
+            extra = {k: v for k, v in file_info.items()
+                     if k not in ('source', 'size', 'category', 'rel_path', 'root_label', 'device_id', 'mtime_ns')}
+            if extra:
+                self._extra[index] = extra
+
+    def extend(self, records):
+        for file_info in records:
+            self.append(file_info)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.take(range(*index.indices(len(self))))
+        if index < 0:
+            index += len(self)
+        source_folder, rel_folder = self._folders[self._folder[index]]
+        name = self._names[index]
+        file_info = {
+            'source': source_folder + name,
+            'size': self._sizes[index],
+            'category': self._values[self._category[index]],
+            'rel_path': rel_folder + self._renamed.get(index, name),
+            'root_label': self._values[self._label[index]],
+        }
+        device_id = self._values[self._device[index]]
+        if device_id is not None:
+            file_info['device_id'] = device_id
+        if self._mtimes[index] >= 0:
+            file_info['mtime_ns'] = self._mtimes[index]
+        if index in self._extra:
+            file_info.update(self._extra[index])
+        return file_info
+
+    def __iter__(self):
+        for index in range(len(self._names)):
+            yield self[index]
+
+    @property
+    def total_size(self):
+        return sum(self._sizes)
+
+    def take(self, indexes):
+        """New FileRecordList with the records at indexes, in that order."""
+        result = FileRecordList()
+        # Same string tables, so folder and value ids stay valid
+        result._folders = self._folders
+        result._folder_ids = self._folder_ids
+        result._values = self._values
+        result._value_ids = self._value_ids
+        for new_index, index in enumerate(indexes):
+            result._folder.append(self._folder[index])
+            result._names.append(self._names[index])
+            result._sizes.append(self._sizes[index])
+            result._mtimes.append(self._mtimes[index])
+            result._category.append(self._category[index])
+            result._label.append(self._label[index])
+            result._device.append(self._device[index])
+            if index in self._renamed:
+                result._renamed[new_index] = self._renamed[index]
+            if index in self._extra:
+                result._extra[new_index] = self._extra[index]
+        return result
+
+    def locality_order(self, size_class=None, descending=False):
+        """
+        Indexes in CopyScheduler locality order: by device_id (else
+        root_label), source folder, then name; first by size_class(size)
+        when given (descending: largest class first). Sorted in stable passes
+        over the columns, so no key tuple or record dict is built per file.
+        """
+        names = self._names
+        order = sorted(range(len(names)), key=names.__getitem__)
+
+        # Rank of each folder by its source folder, shared by equal ones
+        sources = [folder[0].rstrip(self._SEPARATORS) for folder in self._folders]
+        folder_rank = array('I', [0]) * len(sources)
+        rank = 0
+        last = None
+        for folder_id in sorted(range(len(sources)), key=sources.__getitem__):
+            if sources[folder_id] != last:
+                rank += 1
+                last = sources[folder_id]
+            folder_rank[folder_id] = rank
+        folder_of = self._folder
+        order.sort(key=lambda i: folder_rank[folder_of[i]])
+
+        # Rank of each interned device / label value
+        text = [value or "" for value in self._values]
+        value_rank = array('I', [0]) * len(text)
+        for rank, value_id in enumerate(sorted(range(len(text)), key=text.__getitem__)):
+            value_rank[value_id] = rank
+        device, label = self._device, self._label
+        order.sort(key=lambda i: value_rank[device[i] or label[i]])
+
+        if size_class is not None:
+            sizes = self._sizes
+            sign = -1 if descending else 1
+            order.sort(key=lambda i: sign * size_class(sizes[i]))
+        return order
+
+    def filter(self, categories=None, exclude_categories=None, predicate=None):
+        """
+        Records of the given categories / not of exclude_categories /
+        matching predicate(file_info), as a new FileRecordList.
+        """
+        wanted = None if categories is None else {self._value_ids.get(c) for c in categories}
+        unwanted = {self._value_ids.get(c) for c in exclude_categories or ()}
+        indexes = []
+        for index, value_id in enumerate(self._category):
+            if wanted is not None and value_id not in wanted:
+                continue
+            if value_id in unwanted:
+                continue
+            if predicate is not None and not predicate(self[index]):
+                continue
+            indexes.append(index)
+        return self.take(indexes)
+
+    def limit_per_category(self, limit):
+        """The first limit records of each category (test mode)."""
+        counts = {}
+        indexes = []
+        for index, value_id in enumerate(self._category):
+            count = counts.get(value_id, 0)
+            if count < limit:
+                indexes.append(index)
+                counts[value_id] = count + 1
+        return self.take(indexes)
+
+
+class ScanCatalog:
+    """
+    On-disk listing cache for incremental scans (SQLite, one row per folder).
+    A folder whose mtime has not changed since the last scan still has the
+    same entries, so its cached listing (child folders, file names) is
+    reused instead of calling scandir again. Editing a file in place does
+    not touch the folder mtime, so the selected files of a cached folder are
+    still stat'ed (see BackupEngine._scan_dir_cached); only the listing is
+    saved, which pays off where listing a folder is slow (network shares,
+    slow USB disks) and hardly at all on a local disk. Rows are read one
+    folder at a time, not loaded up front.
+    """
+    # Folders modified this close to the previous scan are re-listed anyway
+    # (coarse mtime resolution, e.g. 2 s on FAT)
+    MTIME_SLACK_NS = 2 * 10**9
+    FLUSH_EVERY = 2000
+
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS dirs ("
+            "path TEXT PRIMARY KEY, mtime_ns INTEGER, scanned_ns INTEGER, subdirs TEXT, files TEXT)"
+        )
+        self.lock = threading.Lock()
+        self.pending = []
+        self.visited = set()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path, mtime_ns):
+        """Cached (subdirs, files) if the folder is unchanged, else None."""
+        with self.lock:
+            self.visited.add(path)
+            row = self.conn.execute("SELECT mtime_ns, scanned_ns, subdirs, files FROM dirs WHERE path = ?", (path,)).fetchone()
+        if row is None or row[0] != mtime_ns or mtime_ns >= row[1] - self.MTIME_SLACK_NS:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[2]), json.loads(row[3])
+
+    def put(self, path, mtime_ns, subdirs, files):
+        """
+        subdirs: [[name, hidden], ...]
+        files: [[name, size_or_None, mtime_ns_or_None], ...] (None when not stat'ed)
+        """
+        row = (path, mtime_ns, time.time_ns(), json.dumps(subdirs), json.dumps(files))
+        with self.lock:
+            self.visited.add(path)
+            self.pending.append(row)
+            if len(self.pending) >= self.FLUSH_EVERY:
+                self._flush()
+
+    def _flush(self):
+        if self.pending:
+            self.conn.executemany("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?, ?)", self.pending)
+            self.conn.commit()
+            self.pending = []
+
+    def close(self, prune_roots=None):
+        """
+        Writes pending rows. prune_roots: folders that were fully walked;
+        rows below them that were not visited (deleted or now excluded) are dropped.
+        """
+        with self.lock:
+            self._flush()
+            if prune_roots:
+                prefixes = tuple(r if r.endswith(os.sep) else r + os.sep for r in prune_roots)
+                stale = [(path,) for (path,) in self.conn.execute("SELECT path FROM dirs")
+                         if path not in self.visited and (path in prune_roots or path.startswith(prefixes))]
+                if stale:
+                    self.conn.executemany("DELETE FROM dirs WHERE path = ?", stale)
+                    self.conn.commit()
+            self.conn.close()
+
+
+class SourceHashCache:
+    """
+    Persistent digests of source files (SQLite), so unchanged files are not
+    hashed again on every run. Rows are keyed by (device, inode, algorithm)
+    and only trusted while size and mtime_ns still match; a changed file just
+    misses and is replaced on the next put. Beyond max_entries the least
+    recently used rows are dropped on close.
+    Lookups query one row at a time: only rows not written yet and the keys
+    of hits are held in memory.
+    Used by the deduplicating store, which needs a digest before it can skip
+    a copy.
+    """
+    # Same reasoning as ScanCatalog: a file written within this window of its
+    # hashing may change again without a visible mtime change
+    MTIME_SLACK_NS = 2 * 10**9
+    FLUSH_EVERY = 2000
+
+    def __init__(self, db_path, max_entries=500000):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            "dev INTEGER, ino INTEGER, algorithm TEXT, size INTEGER, mtime_ns INTEGER, "
+            "hashed_ns INTEGER, used_ns INTEGER, digest TEXT, PRIMARY KEY (dev, ino, algorithm))"
+        )
+        self.lock = threading.Lock()
+        self.pending = {}  # key -> (size, mtime_ns, hashed_ns, digest), not written yet
+        self.used = set()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(st, algorithm):
+        # No stable inode (some FAT drivers report 0): not cacheable
+        if not st.st_ino:
+            return None
+        return (st.st_dev, st.st_ino, algorithm)
+
+    def get(self, st, algorithm):
+        """Cached digest for a file with this os.stat result, else None."""
+        key = self._key(st, algorithm)
+        row = None
+        if key is not None:
+            with self.lock:
+                row = self.pending.get(key)
+                if row is None:
+                    row = self.conn.execute(
+                        "SELECT size, mtime_ns, hashed_ns, digest FROM hashes WHERE dev = ? AND ino = ? AND algorithm = ?",
+                        key
+                    ).fetchone()
+        if (row is None or row[0] != st.st_size or row[1] != st.st_mtime_ns
+                or st.st_mtime_ns >= row[2] - self.MTIME_SLACK_NS):
+            self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+            self.used.add(key)
+        return row[3]
+
+    def put(self, st, algorithm, digest):
+        """st: os.stat of the source taken before it was read."""
+        key = self._key(st, algorithm)
+        if key is None:
+            return
+        now = time.time_ns()
+        with self.lock:
+            self.pending[key] = (st.st_size, st.st_mtime_ns, now, digest)
+            if len(self.pending) >= self.FLUSH_EVERY:
+                self._flush()
+
+    def _flush(self):
+        if self.pending:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [key + (size, mtime_ns, hashed_ns, hashed_ns, digest)
+                 for key, (size, mtime_ns, hashed_ns, digest) in self.pending.items()]
+            )
+            self.conn.commit()
+            self.pending = {}
+
+    def close(self):
+        """Writes pending rows, refreshes hit rows and evicts down to max_entries."""
+        with self.lock:
+            self._flush()
+            if self.used:
+                now = time.time_ns()
+                self.conn.executemany(
+                    "UPDATE hashes SET used_ns = ? WHERE dev = ? AND ino = ? AND algorithm = ?",
+                    [(now,) + key for key in self.used]
+                )
+            excess = self.conn.execute("SELECT COUNT(*) FROM hashes").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.conn.execute(
+                    "DELETE FROM hashes WHERE rowid IN (SELECT rowid FROM hashes ORDER BY used_ns LIMIT ?)",
+                    (excess,)
+                )
+            self.conn.commit()
+            self.conn.close()
+
+
+class SnapshotManifest:
+    """
+    File list of one snapshot (manifest.jsonl in the snapshot folder).
+    One JSON line per file:
+      {"path": "Categoria/label/rel/path", "size": 123, "mtime_ns": 456, "ref": null}
+    size/mtime_ns are those of the source when it was backed up. "ref" is set
+    when the bytes are not inside this snapshot (no hardlink support on the
+    destination) and names where they are, relative to the destination root.
+    Files stored compressed (copy_files compress=...) add "codec": "gzip" and
+    live at <path>.gz.
+    A later {"path": ..., "removed": true} line drops the entry again (a copy
+    that failed its deferred verification).
+    An optional first line {"info": {...}} describes the snapshot itself
+    (e.g. the Android devices it was pulled from, see load_info).
+    """
+    FILE_NAME = "manifest.jsonl"
+
+    def __init__(self, snapshot_path, info=None):
+        self.snapshot_name = os.path.basename(str(snapshot_path))
+        self.file = open(os.path.join(str(snapshot_path), self.FILE_NAME), "a", encoding="utf-8")
+        self.lock = threading.Lock()
+        if info and self.file.tell() == 0:
+            self.file.write(json.dumps({'info': info}) + "\n")
+
+    @staticmethod
+    def key_for(file_info):
+        """Snapshot-relative path of a file record, always with '/' separators."""
+        parts = [file_info['category'], file_info.get('root_label', ""), file_info['rel_path']]
+        return "/".join(p.replace("\\", "/").strip("/") for p in parts if p)
+
+    def add(self, key, size, mtime_ns, ref=None, codec=None):
+        entry = {'path': key, 'size': size, 'mtime_ns': mtime_ns, 'ref': ref or None}
+        if codec:
+            entry['codec'] = codec
+        with self.lock:
+            self.file.write(json.dumps(entry) + "\n")
+
+    def remove(self, key):
+        with self.lock:
+            self.file.write(json.dumps({'path': key, 'removed': True}) + "\n")
+
+    def close(self):
+        self.file.close()
+
+    @staticmethod
+    def load(snapshot_path):
+        """{path: (size, mtime_ns, ref, codec)} from a snapshot manifest, or None if it has none."""
+        manifest_path = os.path.join(str(snapshot_path), SnapshotManifest.FILE_NAME)
+        if not os.path.exists(manifest_path):
+            return None
+        entries = {}
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # truncated last line of an interrupted run
+                if 'path' not in entry:
+                    continue
+                if entry.get('removed'):
+                    entries.pop(entry['path'], None)
+                    continue
+                entries[entry['path']] = (entry['size'], entry['mtime_ns'], entry.get('ref'), entry.get('codec'))
+        return entries
+
+    @staticmethod
+    def load_info(snapshot_path):
+        """The {"info": ...} of a snapshot manifest, or {} if it has none."""
+        try:
+            with open(os.path.join(str(snapshot_path), SnapshotManifest.FILE_NAME), "r", encoding="utf-8") as f:
+                entry = json.loads(f.readline())
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(entry, dict):
+            return {}
+        return entry.get('info') or {}
+
+    @staticmethod
+    def previous_snapshot(destination_root, prefix, current_name, match=None):
+        """
+        PreviousSnapshot for the newest prefix+timestamp folder other than
+        current_name, or None. match: only snapshots whose load_info passes
+        match(info) are considered.
+        """
+        try:
+            names = os.listdir(destination_root)
+        except OSError:
+            return None
+        candidates = []
+        for name in names:
+            if name == current_name or not name.startswith(prefix):
+                continue
+            ts = name[len(prefix):]
+            if ts.isdigit():
+                candidates.append((int(ts), name))
+        for _, name in sorted(candidates, reverse=True):
+            path = os.path.join(destination_root, name)
+            if os.path.isdir(path) and (match is None or match(SnapshotManifest.load_info(path))):
+                return PreviousSnapshot(str(destination_root), name)
+        return None
+
+
+class SnapshotJournal:
+    """
+    Append-only record of the files a copy_files run has finished
+    (journal.jsonl in the snapshot folder), so an interrupted snapshot can be
+    resumed instead of started over. One JSON line per finished file:
+      {"path": "Categoria/label/rel/path", "size": 123, "mtime_ns": 456}
+    and {"complete": true} once the run got to the end.
+    Lines are written in groups: every SYNC_EVERY files or SYNC_SECONDS the
+    files of the group are flushed to the media (one os.sync; on Windows each
+    file was fsync'ed as it was written) and then the group is appended and
+    fsync'ed, so a journaled file is on the media even if the stick is
+    pulled out.
+    """
+    FILE_NAME = "journal.jsonl"
+    SYNC_EVERY = 256
+    SYNC_SECONDS = 5
+
+    def __init__(self, snapshot_path):
+        self.file = open(os.path.join(str(snapshot_path), self.FILE_NAME), "a", encoding="utf-8")
+        self.lock = threading.Lock()
+        self.pending = []
+        self.last_sync = time.time()
+
+    def add(self, key, size, mtime_ns):
+        with self.lock:
+            self.pending.append(json.dumps({'path': key, 'size': size, 'mtime_ns': mtime_ns}))
+            if len(self.pending) >= self.SYNC_EVERY or time.time() - self.last_sync >= self.SYNC_SECONDS:
+                self._sync()
+
+    def _sync(self):
+        if self.pending:
+            _flush_to_media()
+            self.file.write("\n".join(self.pending) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.pending = []
+        self.last_sync = time.time()
+
+    def close(self, complete=False):
+        with self.lock:
+            if complete:
+                self.pending.append(json.dumps({'complete': True}))
+            self._sync()
+            self.file.close()
+
+    @staticmethod
+    def load(snapshot_path):
+        """({path: (size, mtime_ns)}, complete) of a snapshot, or (None, False) without journal."""
+        journal_path = os.path.join(str(snapshot_path), SnapshotJournal.FILE_NAME)
+        if not os.path.exists(journal_path):
+            return None, False
+        done = {}
+        complete = False
+        with open(journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn last line
+                if entry.get('complete'):
+                    complete = True
+                else:
+                    done[entry['path']] = (entry['size'], entry['mtime_ns'])
+        return done, complete
+
+    @staticmethod
+    def find_resumable(destination_root, prefix="Backup_"):
+        """Name of the newest snapshot whose journal has no completion mark, else None."""
+        try:
+            names = os.listdir(destination_root)
+        except OSError:
+            return None
+        stamps = [n for n in names if n.startswith(prefix) and n[len(prefix):].isdigit()]
+        for name in sorted(stamps, key=lambda n: int(n[len(prefix):]), reverse=True):
+            done, complete = SnapshotJournal.load(os.path.join(str(destination_root), name))
+            if done is None:
+                continue  # older snapshot without journal
+            return None if complete else name
+        return None
+
+
+class PreviousSnapshot:
+    """The snapshot an incremental run compares against."""
+    # exFAT/FAT store mtimes with coarse resolution (up to 2 s)
+    MTIME_SLACK_NS = 2 * 10**9
+
+    def __init__(self, destination_root, name):
+        self.destination_root = destination_root
+        self.name = name
+        self.entries = SnapshotManifest.load(os.path.join(destination_root, name))
+        self.links_supported = True
+
+    def unchanged_location(self, key, size, mtime_ns):
+        """
+        (location, codec) of an unchanged file: where its bytes live, relative
+        to the destination root, and how they are stored (None = as is).
+        None if the file changed.
+        """
+        if self.entries is not None:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != size or entry[1] != mtime_ns:
+                return None
+            codec = entry[3]
+            return entry[2] or (f"{self.name}/{key}.gz" if codec else f"{self.name}/{key}"), codec
+
+        # Older snapshot without manifest: compare with the copied file (copy2 keeps mtime)
+        location = f"{self.name}/{key}"
+        try:
+            st = os.stat(os.path.join(self.destination_root, location))
+        except OSError:
+            return None
+        if st.st_size != size or abs(st.st_mtime_ns - mtime_ns) > self.MTIME_SLACK_NS:
+            return None
+        return location, None
+
+
+class ObjectStore:
+    """
+    Content-addressed backup store (optional destination format).
+    Layout under <destination>/AutoBackupStore:
+      objects/ab/cdef...   file contents, named by their SHA-256, stored once
+      snapshots/Backup_<ts>.jsonl   one line per file:
+        {"path": "Categoria/label/rel/path", "size": .., "mtime_ns": .., "hash": ".."}
+      tmp/                 partial objects being written
+    """
+    DIR_NAME = "AutoBackupStore"
+    HASH_NAME = "sha256"
+
+    def __init__(self, store_root):
+        self.root = str(store_root)
+        self.objects_dir = os.path.join(self.root, "objects")
+        self.snapshots_dir = os.path.join(self.root, "snapshots")
+        self.tmp_dir = os.path.join(self.root, "tmp")
+        for d in (self.objects_dir, self.snapshots_dir, self.tmp_dir):
+            os.makedirs(d, exist_ok=True)
+        self.known = set()      # digests known to be stored
+        self.fanout_dirs = set()
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest[2:])
+
+    def has(self, digest):
+        if digest in self.known:
+            return True
+        if os.path.exists(self.object_path(digest)):
+            self.known.add(digest)
+            return True
+        return False
+
+    def put(self, src, copy_func):
+        """
+        Stores src. copy_func(src, dst) copies and returns the digest of the
+        bytes it wrote, so a file that changed since it was hashed is stored
+        under its real content. Returns (digest, stored) where stored is False
+        if the content was already present.
+        """
+        tmp = os.path.join(self.tmp_dir, f"{threading.get_ident()}_{time.time_ns()}.part")
+        try:
+            digest = copy_func(src, tmp)
+            if self.has(digest):
+                os.remove(tmp)
+                return digest, False
+            fanout = os.path.join(self.objects_dir, digest[:2])
+            if fanout not in self.fanout_dirs:
+                os.makedirs(fanout, exist_ok=True)
+                self.fanout_dirs.add(fanout)
+            os.replace(tmp, self.object_path(digest))
+            self.known.add(digest)
+            return digest, True
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def snapshot_names(self):
+        names = [n[:-len(".jsonl")] for n in os.listdir(self.snapshots_dir) if n.endswith(".jsonl")]
+        return sorted(names, key=lambda n: int(n.split("_")[-1]) if n.split("_")[-1].isdigit() else -1)
+
+    def open_tree(self, snapshot_name):
+        return open(os.path.join(self.snapshots_dir, snapshot_name + ".jsonl"), "a", encoding="utf-8")
+
+    def load_tree(self, snapshot_name):
+        """{path: (size, mtime_ns, hash)} of a snapshot."""
+        tree = {}
+        path = os.path.join(self.snapshots_dir, snapshot_name + ".jsonl")
+        if not os.path.exists(path):
+            return tree
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # truncated last line of an interrupted run
+                tree[entry['path']] = (entry['size'], entry['mtime_ns'], entry['hash'])
+        return tree
+
+
+class PackWriter:
+    """
+    Packs the small files of a snapshot into tar containers, one series per
+    category (optional, copy_files pack_small=True): one big sequential
+    write instead of a create + mkdir per file, which is what makes FAT/exFAT
+    sticks crawl. Layout inside the snapshot:
+      Categoria/_pack_0001.tar              plain tar, readable by any archiver
+      Categoria/_pack_0001.tar.index.jsonl  one line per member:
+        {"path": "label/rel/path", "offset": 1536, "size": 123, "mtime_ns": 456, "hash": ".."}
+    offset is where the member's bytes start in the tar, so a single file is
+    extracted with one seek (see extract). A container is closed once it
+    passes container_size; on_close(category, members) is then called with
+    the [(member, size, mtime_ns), ...] it holds (used by the copy journal).
+    """
+    PREFIX = "_pack_"
+    INDEX_SUFFIX = ".index.jsonl"
+
+    def __init__(self, snapshot_path, container_size, algorithm=None, on_close=None):
+        self.snapshot_path = str(snapshot_path)
+        self.container_size = container_size
+        self.algorithm = algorithm  # hash of each member, for verify()
+        self.on_close = on_close
+        self.lock = threading.Lock()
+        self.current = {}           # category -> (tar, index file, number, members)
+        self.containers = []
+
+    def _close_container(self, category, entry):
+        entry[0].close()
+        if FSYNC_EACH_FILE:
+            # Journaled members must be on the media (elsewhere the journal syncs)
+            entry[0].fileobj.flush()
+            os.fsync(entry[0].fileobj.fileno())
+            entry[1].flush()
+            os.fsync(entry[1].fileno())
+        entry[0].fileobj.close()
+        entry[1].close()
+        if self.on_close is not None:
+            self.on_close(category, entry[3])
+
+    def _open_container(self, category):
+        folder = os.path.join(self.snapshot_path, category)
+        previous = self.current.pop(category, None)
+        if previous is not None:
+            self._close_container(category, previous)
+            number = previous[2] + 1
+        else:
+            # A resumed snapshot keeps its finished containers: number after them
+            os.makedirs(folder, exist_ok=True)
+            numbers = [int(n[len(self.PREFIX):-len(".tar")]) for n in os.listdir(folder)
+                       if n.startswith(self.PREFIX) and n.endswith(".tar") and n[len(self.PREFIX):-len(".tar")].isdigit()]
+            number = max(numbers, default=0) + 1
+        path = os.path.join(folder, f"{self.PREFIX}{number:04d}.tar")
+        # Own file object: still open after the tar trailer, to fsync it
+        entry = (tarfile.open(fileobj=open(path, "wb"), mode="w", format=tarfile.PAX_FORMAT),
+                 open(path + self.INDEX_SUFFIX, "w", encoding="utf-8"), number, [])
+        self.current[category] = entry
+        self.containers.append(path)
+        return entry
+
+    def add(self, category, member, src, st):
+        """Appends src (os.stat result st) as member of the category's container."""
+        h = hashlib.new(self.algorithm) if self.algorithm else None
+        with open(src, "rb") as f:
+            # Read before taking the lock: other workers keep writing meanwhile
+            data = f.read(st.st_size + 1)
+        if len(data) != st.st_size:
+            raise IOError("File changed while it was read")
+        if h is not None:
+            h.update(data)
+
+        info = tarfile.TarInfo(member)
+        info.size = st.st_size
+        info.mtime = st.st_mtime
+        info.mode = st.st_mode & 0o777
+        with self.lock:
+            entry = self.current.get(category)
+            if entry is None or entry[0].offset >= self.container_size:
+                entry = self._open_container(category)
+            tar, index = entry[0], entry[1]
+            tar.addfile(info, io.BytesIO(data))
+            entry[3].append((member, st.st_size, st.st_mtime_ns))
+            # Data is padded to whole 512-byte blocks right after the header(s)
+            offset = tar.offset - -(-st.st_size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+            index.write(json.dumps({
+                'path': member, 'offset': offset, 'size': st.st_size,
+                'mtime_ns': st.st_mtime_ns, 'hash': h.hexdigest() if h else None
+            }) + "\n")
+
+    def close(self):
+        with self.lock:
+            for category, entry in self.current.items():
+                self._close_container(category, entry)
+            self.current = {}
+
+    @staticmethod
+    def discard_unfinished(snapshot_path, done_keys):
+        """
+        Resume helper: deletes containers (and indexes) holding any member
+        missing from done_keys, i.e. left open by an interrupted run. Their
+        members are packed again.
+        """
+        for category in os.listdir(str(snapshot_path)):
+            folder = os.path.join(str(snapshot_path), category)
+            if not os.path.isdir(folder):
+                continue
+            for name in os.listdir(folder):
+                if not (name.startswith(PackWriter.PREFIX) and name.endswith(".tar")):
+                    continue
+                container = os.path.join(folder, name)
+                try:
+                    entries = PackWriter.read_index(container)
+                except FileNotFoundError:
+                    entries = None
+                if entries is None or any(f"{category}/{e['path']}" not in done_keys for e in entries):
+                    for path in (container, container + PackWriter.INDEX_SUFFIX):
+                        if os.path.exists(path):
+                            os.remove(path)
+
+    def verify(self, stop_event=None):
+        """
+        Reads the closed containers back from the media and checks every
+        member hash. Returns the category/member paths that do not match.
+        """
+        failed = []
+        for path in self.containers:
+            category = os.path.basename(os.path.dirname(path))
+            with open(path, "rb", buffering=0) as f:
+                _drop_page_cache(f.fileno(), flush=True)
+                for entry in self.read_index(path):
+                    if stop_event is not None and stop_event.is_set():
+                        return failed
+                    f.seek(entry['offset'])
+                    h = hashlib.new(self.algorithm)
+                    h.update(f.read(entry['size']))
+                    if h.hexdigest() != entry['hash']:
+                        failed.append(f"{category}/{entry['path']}")
+                _drop_page_cache(f.fileno())
+        return failed
+
+    @staticmethod
+    def containers(snapshot_path):
+        """[(category, container path), ...] of the finished containers (with an index) of a snapshot."""
+        found = []
+        for category in sorted(os.listdir(str(snapshot_path))):
+            folder = os.path.join(str(snapshot_path), category)
+            if not os.path.isdir(folder):
+                continue
+            for name in sorted(os.listdir(folder)):
+                if name.startswith(PackWriter.PREFIX) and name.endswith(PackWriter.INDEX_SUFFIX):
+                    found.append((category, os.path.join(folder, name[:-len(PackWriter.INDEX_SUFFIX)])))
+        return found
+
+    @staticmethod
+    def read_index(container_path):
+        entries = []
+        with open(container_path + PackWriter.INDEX_SUFFIX, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue  # truncated last line of an interrupted run
+        return entries
+
+    @staticmethod
+    def extract(snapshot_path, key, target_path):
+        """
+        Extracts one packed file, key = "Categoria/label/rel/path" (as in the
+        manifest), to target_path with its original mtime. Only the side
+        indexes of that category are read, never the tar headers.
+        """
+        category, _, member = key.partition("/")
+        folder = os.path.join(str(snapshot_path), category)
+        for name in sorted(os.listdir(folder)):
+            if not (name.startswith(PackWriter.PREFIX) and name.endswith(PackWriter.INDEX_SUFFIX)):
+                continue
+            container = os.path.join(folder, name[:-len(PackWriter.INDEX_SUFFIX)])
+            for entry in PackWriter.read_index(container):
+                if entry['path'] != member:
+                    continue
+                os.makedirs(os.path.dirname(str(target_path)) or ".", exist_ok=True)
+                with open(container, "rb") as fsrc, open(target_path, "wb") as fdst:
+                    fsrc.seek(entry['offset'])
+                    fdst.write(fsrc.read(entry['size']))
+                os.utime(target_path, ns=(entry['mtime_ns'], entry['mtime_ns']))
+                return True
+        raise FileNotFoundError(f"{key} is not packed in {snapshot_path}")
+
+
+class DirectoryCreator:
+    """
+    Memoized mkdir for one copy run: every destination folder is created
+    (parents first) the first time it is needed and remembered, so further
+    files in it cost a set lookup instead of stat/mkdir calls on a slow
+    USB filesystem. prepare() creates a whole known set up front.
+    """
+    def __init__(self, root):
+        self.root = os.path.normpath(str(root))
+        self.known = {self.root}
+        self.created = 0
+
+    def ensure(self, path):
+        path = os.path.normpath(str(path))
+        if path in self.known:
+            return
+        missing = []
+        while path not in self.known:
+            missing.append(path)
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+        for folder in reversed(missing):
+            try:
+                os.mkdir(folder)
+                self.created += 1
+            except OSError:
+                # Created by another worker or an earlier run (or a drive root)
+                if not os.path.isdir(folder):
+                    raise
+            self.known.add(folder)
+
+    def prepare(self, folders, stop_event=None):
+        # Sorted: parents come before their children
+        for folder in sorted({os.path.normpath(str(f)) for f in folders}):
+            if stop_event is not None and stop_event.is_set():
+                return
+            self.ensure(folder)
+
+
+class CopyInterrupted(Exception):
+    """A copy was abandoned because stop_event was set."""
+
+
+class CopyBackend:
+    """
+    Moves file bytes for copy_files. Uses the kernel copy path where the OS
+    has one (os.copy_file_range, or sendfile between files on Linux), and
+    large buffered readinto/write otherwise or when the bytes must be seen
+    in Python (hashing): copies verified with "full" (and compressed or
+    deduplicated ones) always take the buffered path, since reading the
+    source a second time to hash it would cost more than the kernel path
+    saves. Every call is bounded by an adaptive chunk size, so
+    pause_event/stop_event are honoured between calls; the size grows while
+    calls are fast and shrinks when the destination is slow.
+    Per-method calls and bytes are counted in .stats (copy_stats['io']).
+
+    mode: "auto" (kernel path when available), "buffered" (read/write only)
+          or "shutil" (plain shutil.copyfile, the old behaviour, for comparison).
+    """
+    MIN_CHUNK = 256 * 1024
+    # Smallest read buffer, for files smaller than that
+    MIN_BUFFER = 64 * 1024
+    MAX_CHUNK = 16 * 1024 * 1024
+    # Aim for calls in this time window (seconds)
+    FAST_CALL = 0.05
+    SLOW_CALL = 0.5
+    # errno values meaning "this copy path does not work here"
+    FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EBADF, errno.EPERM,
+                       getattr(errno, 'EOPNOTSUPP', errno.EINVAL), getattr(errno, 'ENOTSUP', errno.EINVAL)}
+
+    def __init__(self, engine, mode="auto"):
+        self.engine = engine
+        self.mode = mode
+        self.chunk_size = 1024 * 1024
+        self.lock = threading.Lock()
+        self.stats = {}
+        # (source st_dev, destination st_dev) -> kernel methods that failed
+        # between those filesystems; kept for the run
+        self.unsupported = {}
+
+    def reset_stats(self):
+        """New per-run counters: {method: {'calls': n, 'bytes': b}}."""
+        self.stats = {}
+        self.unsupported = {}
+        return self.stats
+
+    def _record(self, method, nbytes, elapsed):
+        with self.lock:
+            entry = self.stats.setdefault(method, {'calls': 0, 'bytes': 0})
+            entry['calls'] += 1
+            entry['bytes'] += nbytes
+        # Adapt the chunk size to the throughput the destination achieves
+        if nbytes >= self.chunk_size and elapsed < self.FAST_CALL:
+            self.chunk_size = min(self.chunk_size * 2, self.MAX_CHUNK)
+        elif elapsed > self.SLOW_CALL:
+            self.chunk_size = max(self.chunk_size // 2, self.MIN_CHUNK)
+
+    def _kernel_methods(self, devices):
+        if self.mode != "auto":
+            return []
+        methods = []
+        if hasattr(os, 'copy_file_range'):
+            methods.append('copy_file_range')
+        if sys.platform.startswith('linux') and hasattr(os, 'sendfile'):
+            methods.append('sendfile')
+        failed = self.unsupported.get(devices, ())
+        return [m for m in methods if m not in failed]
+
+    def _check_events(self, src):
+        self.engine.pause_event.wait()
+        if self.engine.stop_event.is_set():
+            raise CopyInterrupted(str(src))
+
+    def copy(self, src, dst, on_chunk=None):
+        """Copies the bytes of src to dst (no metadata). Removes dst on failure."""
+        try:
+            if self.mode == "shutil" and on_chunk is None:
+                self._check_events(src)
+                start = time.time()
+                shutil.copyfile(src, dst)
+                self._record("shutil", os.path.getsize(dst), time.time() - start)
+                return
+
+            with open(src, "rb", buffering=0) as fsrc, open(dst, "wb", buffering=0) as fdst:
+                offset = 0
+                done = False
+                if on_chunk is None:
+                    devices = (os.fstat(fsrc.fileno()).st_dev, os.fstat(fdst.fileno()).st_dev)
+                    for method in self._kernel_methods(devices):
+                        done, offset = self._copy_kernel(method, src, fsrc, fdst, offset, devices)
+                        if done:
+                            break
+                if not done:
+                    fsrc.seek(offset)
+                    fdst.seek(offset)
+                    self._copy_buffered(src, fsrc, fdst, on_chunk)
+                if FSYNC_EACH_FILE:
+                    # While the write handle is open: copystat may make dst read-only
+                    os.fsync(fdst.fileno())
+        except BaseException:
+            # Never leave a partial file behind
+            try:
+                os.remove(dst)
+            except OSError:
+                pass
+            raise
+
+    def compress(self, src, dst, on_chunk=None, level=6):
+        """
+        Writes src gzip-compressed to dst, chunk by chunk like copy (events
+        honoured, dst removed on failure). Returns the compressed size.
+        """
+        try:
+            with open(src, "rb", buffering=0) as fsrc, open(dst, "wb") as fdst:
+                gz = gzip.GzipFile(os.path.basename(str(src)), "wb", level, fdst, int(os.fstat(fsrc.fileno()).st_mtime))
+                with gz:
+                    buf = bytearray(self._buffer_size(fsrc))
+                    view = memoryview(buf)
+                    while True:
+                        self._check_events(src)
+                        start = time.time()
+                        n = fsrc.readinto(view)
+                        if not n:
+                            break
+                        if on_chunk:
+                            on_chunk(view[:n])
+                        gz.write(view[:n])
+                        self._record("gzip", n, time.time() - start)
+                if FSYNC_EACH_FILE:
+                    fdst.flush()
+                    os.fsync(fdst.fileno())
+                return fdst.tell()
+        except BaseException:
+            try:
+                os.remove(dst)
+            except OSError:
+                pass
+            raise
+
+    def _copy_kernel(self, method, src, fsrc, fdst, offset, devices):
+        """
+        Returns (done, offset). done is False if the method is unusable
+        between these devices (then remembered in unsupported).
+        """
+        in_fd = fsrc.fileno()
+        out_fd = fdst.fileno()
+        while True:
+            self._check_events(src)
+            count = self.chunk_size
+            start = time.time()
+            try:
+                if method == 'copy_file_range':
+                    sent = os.copy_file_range(in_fd, out_fd, count, offset, offset)
+                else:
+                    os.lseek(out_fd, offset, os.SEEK_SET)
+                    sent = os.sendfile(out_fd, in_fd, offset, count)
+            except OSError as e:
+                if e.errno in self.FALLBACK_ERRNOS:
+                    with self.lock:
+                        self.unsupported.setdefault(devices, set()).add(method)
+                    return False, offset
+                raise
+            if sent == 0:
+                if offset == 0 and os.fstat(in_fd).st_size > 0:
+                    # Some filesystems report 0 instead of an error
+                    with self.lock:
+                        self.unsupported.setdefault(devices, set()).add(method)
+                    return False, offset
+                return True, offset
+            offset += sent
+            self._record(method, sent, time.time() - start)
+
+    def _buffer_size(self, fsrc):
+        """Current chunk size, but no bigger than the file: small files get small buffers."""
+        return min(self.chunk_size, max(os.fstat(fsrc.fileno()).st_size, self.MIN_BUFFER))
+
+    def _copy_buffered(self, src, fsrc, fdst, on_chunk=None):
+        size = self._buffer_size(fsrc)
+        buf = bytearray(size)
+        view = memoryview(buf)
+        while True:
+            self._check_events(src)
+            # Follows chunk_size changes made by other copies, within the file size
+            if len(buf) != min(self.chunk_size, size):
+                buf = bytearray(min(self.chunk_size, size))
+                view = memoryview(buf)
+            start = time.time()
+            n = fsrc.readinto(view)
+            if not n:
+                return
+            data = view[:n]
+            if on_chunk:
+                on_chunk(data)
+            while data:
+                written = fdst.write(data)
+                data = data[written:]
+            self._record("read_write", n, time.time() - start)
+
+
+class BackgroundVerifier:
+    """
+    Deferred verification: copies are queued here and checked on a single
+    background thread, either while the copy runs ("parallel") or once it
+    has finished ("after"), so big archives do not slow the copy itself.
+    A file changed at the source before its check is reported as a failure.
+    """
+    def __init__(self, engine, mode):
+        self.engine = engine
+        self.mode = mode
+        self.items = Queue()
+        self.errors = []
+        self.failed = set()   # keys (as given to submit) of the copies that failed
+        self.checked = 0
+        self.thread = None
+
+    def submit(self, src, dst, digest=None, written=None, codec=None, key=None):
+        self.items.put((src, dst, digest, written, codec, key))
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.items.get()
+            if item is None or self.engine.stop_event.is_set():
+                return
+            src, dst, digest, written, codec, key = item
+            try:
+                if not self.engine._check_copy(self.mode, src, dst, digest, written, codec):
+                    self.errors.append(f"Integrity check failed: {src}")
+                    self.failed.add(key)
+            except Exception as e:
+                self.errors.append(f"Error verifying {src}: {str(e)}")
+                self.failed.add(key)
+            self.checked += 1
+
+    def finish(self, progress_callback=None):
+        """Waits for the queued checks and returns their errors."""
+        total = self.checked + self.items.qsize()
+        self.start()
+        self.items.put(None)
+        while self.thread.is_alive():
+            self.thread.join(0.5)
+            if progress_callback:
+                progress_callback("verifying", f"{self.checked}/{total}", 0)
+        return self.errors
+
+
+class CopyScheduler:
+    """
+    Orders the copy work list before it reaches the serial loop or CopyPool.
+    Policies:
+      "walk"         scan order, unchanged
+      "locality"     grouped by source device, then folder, then name, so the
+                     reads move through one folder at a time
+      "small_first"  size classes ascending (many quick files done early),
+                     locality inside each class
+      "large_first"  size classes descending (long sequential transfers
+                     first), locality inside each class
+    Folders stand in for physical placement: file records carry no inode
+    numbers (the scan catalog does not keep them), and files written into
+    one folder together usually sit close together on disk.
+    .stats: policy, files, folder switches (consecutive copies from different
+    folders) before and after ordering, and the seconds spent ordering.
+    """
+    POLICIES = ("walk", "locality", "small_first", "large_first")
+    # Upper bounds of the size classes, in bytes; the last class is open-ended
+    SIZE_CLASSES = (64 * 1024, 1024 * 1024, 64 * 1024 * 1024)
+
+    def __init__(self, policy="locality"):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown schedule policy: {policy}")
+        self.policy = policy
+        self.stats = {'policy': policy}
+
+    @classmethod
+    def size_class(cls, size):
+        return bisect.bisect_right(cls.SIZE_CLASSES, size)
+
+    @staticmethod
+    def _locality_key(file_info):
+        source = file_info['source']
+        return (file_info.get('device_id') or file_info.get('root_label', ""), os.path.dirname(source), source)
+
+    @staticmethod
+    def _folder_switches(files_list):
+        switches = 0
+        last = None
+        for file_info in files_list:
+            folder = os.path.dirname(file_info['source'])
+            if folder != last:
+                switches += 1
+                last = folder
+        return switches
+
+    def _sort_key(self, file_info):
+        if self.policy == "locality":
+            return self._locality_key(file_info)
+        size_class = self.size_class(file_info['size'])
+        if self.policy == "large_first":
+            size_class = -size_class
+        return (size_class,) + self._locality_key(file_info)
+
+    def order(self, files_list):
+        """Returns the records in policy order: a list, or a FileRecordList for one."""
+        start = time.time()
+        if self.policy == "walk":
+            ordered = files_list[:]
+        elif isinstance(files_list, FileRecordList):
+            # Sorted on the columns, so the records stay in their compact form
+            if self.policy == "locality":
+                indexes = files_list.locality_order()
+            else:
+                indexes = files_list.locality_order(self.size_class, self.policy == "large_first")
+            ordered = files_list.take(indexes)
+        else:
+            ordered = sorted(files_list, key=self._sort_key)
+        self.stats.update({
+            'files': len(ordered),
+            'folder_switches_before': self._folder_switches(files_list),
+            'folder_switches': self._folder_switches(ordered),
+            'seconds': time.time() - start,
+        })
+        return ordered
+
+
+class CopyPool:
+    """
+    Copies files on a thread pool. Each copy holds one slot of its source
+    device (file_info 'device_id', else 'root_label') and one of the
+    destination, so a fast SSD source and a USB destination both keep a few
+    operations in flight without thrashing either. Progress is aggregated
+    here and progress_callback is only called from the calling thread.
+    """
+    def __init__(self, engine, workers=4, per_source_device=2, per_destination_device=4):
+        self.engine = engine
+        self.workers = max(1, workers)
+        self.per_source_device = max(1, per_source_device)
+        self.destination_slots = threading.Semaphore(max(1, per_destination_device))
+        self.source_slots = {}
+        self.lock = threading.Lock()
+
+    def _source_slot(self, file_info):
+        device = file_info.get('device_id') or file_info.get('root_label', "")
+        with self.lock:
+            slot = self.source_slots.get(device)
+            if slot is None:
+                slot = threading.Semaphore(self.per_source_device)
+                self.source_slots[device] = slot
+            return slot
+
+    def _worker(self, work, done, copy_one):
+        while True:
+            file_info = work.get()
+            if file_info is None:
+                return
+            if self.engine.stop_event.is_set():
+                done.put((file_info, False, []))
+                continue
+            self.engine.pause_event.wait()
+            try:
+                # Always source then destination: no lock-order deadlocks
+                with self._source_slot(file_info), self.destination_slots:
+                    ok, file_errors = copy_one(file_info)
+            except Exception as e:
+                ok, file_errors = False, [f"Error copying {file_info.get('source')}: {str(e)}"]
+            done.put((file_info, ok, file_errors))
+
+    def run(self, files_list, copy_one, progress_callback=None):
+        """Returns (copied_count, errors) like copy_files."""
+        work = Queue(maxsize=self.workers * 4)
+        done = Queue()
+        state = {'count': 0, 'size': 0}
+        errors = []
+
+        def drain(block=False):
+            while True:
+                try:
+                    file_info, ok, file_errors = done.get(timeout=0.1) if block else done.get_nowait()
+                except Empty:
+                    return
+                block = False
+                errors.extend(file_errors)
+                count, size = self.engine._copied_amount(file_info, ok)
+                state['count'] += count
+                state['size'] += size
+                if progress_callback:
+                    progress_callback("copying", os.path.basename(file_info['source']), state['size'])
+
+        threads = [threading.Thread(target=self._worker, args=(work, done, copy_one), daemon=True) for _ in range(self.workers)]
+        for t in threads:
+            t.start()
+
+        try:
+            for file_info in files_list:
+                # Check Pause
+                self.engine.pause_event.wait()
+
+                # Check Stop
+                if self.engine.stop_event.is_set():
+                    break
+
+                if progress_callback:
+                    progress_callback("copying", os.path.basename(file_info['source']), state['size'])
+
+                while True:
+                    try:
+                        work.put(file_info, timeout=0.1)
+                        break
+                    except Full:
+                        drain()
+                drain()
+        finally:
+            for _ in threads:
+                while True:
+                    try:
+                        work.put(None, timeout=0.1)
+                        break
+                    except Full:
+                        drain()
+            while any(t.is_alive() for t in threads):
+                drain(block=True)
+            drain()
+
+        return state['count'], errors
+
+
+class ParallelScanner:
+    """
+    Walks several scan roots at once on a thread pool.
+    Pending folders live in one deque per physical disk; an idle worker takes
+    the next folder from any disk that is below its concurrency limit, so
+    several disks are scanned together while a single disk never has more
+    than per_device listings in flight. Partitions of one disk share its
+    limit (see _disk_of); a folder that is the mount point of another
+    filesystem moves to that filesystem's disk.
+    Listed records wait in a bounded queue, so workers pause when the
+    consumer falls behind.
+    """
+    def __init__(self, engine, workers=8, per_device=2):
+        self.engine = engine
+        self.workers = max(1, workers)
+        self.per_device = max(1, per_device)
+        self.cond = threading.Condition()
+        self.queues = {}   # disk -> deque of (dir_path, include_files, root, st_dev)
+        self.active = {}   # disk -> folders being listed right now
+        self.pending = 0   # folders queued or being listed
+        self.results = Queue(maxsize=self.workers * 4)
+        self.cancelled = threading.Event()
+        self.disks = {}    # st_dev -> disk key
+
+    @staticmethod
+    def _disk_of(path, st_dev):
+        """
+        Key of the physical disk holding path. Linux: the parent block device
+        in sysfs (sda for sda1, nvme0n1 for nvme0n1p2); macOS: the whole disk
+        of the mounted device (disk2 for disk2s1). Elsewhere, and for devices
+        without a plain parent (LVM, RAID, network), the filesystem itself:
+        on Windows each drive letter counts as one disk.
+        """
+        if sys.platform.startswith("linux"):
+            try:
+                block = os.path.realpath(f"/sys/dev/block/{os.major(st_dev)}:{os.minor(st_dev)}")
+                if os.path.exists(os.path.join(block, "partition")):
+                    block = os.path.dirname(block)
+                if os.path.isdir(block):
+                    return os.path.basename(block)
+            except (OSError, ValueError):
+                pass
+        elif sys.platform == "darwin":
+            try:
+                best = None
+                for part in psutil.disk_partitions():
+                    mp = part.mountpoint.rstrip("/") + "/"
+                    if (path.rstrip("/") + "/").startswith(mp) and (best is None or len(mp) > len(best[0])):
+                        best = (mp, part.device)
+                if best and best[1].startswith("/dev/disk"):
+                    # disk2s1 -> disk2
+                    return "disk" + best[1][len("/dev/disk"):].split("s")[0]
+            except Exception:
+                pass
+        elif os.name == "nt":
+            drive = os.path.splitdrive(os.path.abspath(path))[0]
+            if drive:
+                return drive.upper()
+        return st_dev
+
+    def _device_of(self, path, st_dev=None):
+        """(st_dev, disk key) of a folder; the disk is looked up once per st_dev."""
+        try:
+            if st_dev is None:
+                st_dev = os.stat(path).st_dev
+        except OSError:
+            return None, path
+        disk = self.disks.get(st_dev)
+        if disk is None:
+            disk = self._disk_of(path, st_dev)
+            self.disks[st_dev] = disk
+        return st_dev, disk
+
+    def _put(self, item):
+        """results.put that gives up once the consumer is gone."""
+        while not self.cancelled.is_set():
+            try:
+                self.results.put(item, timeout=0.2)
+                return
+            except Full:
+                continue
+
+    def _take(self):
+        """Next folder from any device with a free slot (call with cond held)."""
+        for device, pending_dirs in self.queues.items():
+            if pending_dirs and self.active[device] < self.per_device:
+                self.active[device] += 1
+                # LIFO: depth-first keeps the deques small and listings local
+                return device, pending_dirs.pop()
+        return None
+
+    def _worker(self, allowed_exts, ext_to_cat, matcher, catalog):
+        try:
+            while True:
+                with self.cond:
+                    while True:
+                        if self.cancelled.is_set() or self.engine.stop_event.is_set():
+                            return
+                        if self.pending == 0:
+                            return
+                        item = self._take()
+                        if item:
+                            break
+                        # Timeout so a stop_event set from outside is noticed
+                        self.cond.wait(0.2)
+
+                device, (dir_path, include_files, root, st_dev) = item
+                start_path, drive_prefix_len, root_label = root
+                try:
+                    records, subdirs = self.engine._scan_dir(dir_path, include_files, drive_prefix_len, root_label, allowed_exts, ext_to_cat, matcher, catalog)
+                except Exception:
+                    records, subdirs = [], []
+
+                if records:
+                    self._put(records)
+
+                # Mount points inside the folder belong to another filesystem
+                placed = []
+                for child in reversed(subdirs):
+                    try:
+                        child_dev = os.lstat(child).st_dev
+                    except OSError:
+                        child_dev = st_dev
+                    if child_dev == st_dev:
+                        placed.append((device, child_dev, child))
+                    else:
+                        child_dev, disk = self._device_of(child, child_dev)
+                        placed.append((disk, child_dev, child))
+
+                with self.cond:
+                    self.active[device] -= 1
+                    for disk, child_dev, child in placed:
+                        self.queues.setdefault(disk, deque()).append((child, True, root, child_dev))
+                        self.active.setdefault(disk, 0)
+                    self.pending += len(subdirs) - 1
+                    self.cond.notify_all()
+        finally:
+            self._put(None)
+
+    def run(self, scan_roots, allowed_exts, ext_to_cat, matcher, catalog=None):
+        """
+        scan_roots: list of (start_path, drive_prefix_len, root_label).
+        Yields file records in completion order.
+        """
+        for root in scan_roots:
+            start_path = root[0]
+            st_dev, disk = self._device_of(start_path)
+            self.queues.setdefault(disk, deque())
+            self.active.setdefault(disk, 0)
+            # The start folder lists its subfolders even if it is excluded itself
+            self.queues[disk].append((start_path, not matcher.is_excluded(start_path), root, st_dev))
+            self.pending += 1
+
+        threads = []
+        for _ in range(self.workers):
+            t = threading.Thread(target=self._worker, args=(allowed_exts, ext_to_cat, matcher, catalog), daemon=True)
+            t.start()
+            threads.append(t)
+
+        try:
+            finished = 0
+            while finished < len(threads):
+                records = self.results.get()
+                if records is None:
+                    finished += 1
+                    continue
+                for file_info in records:
+                    yield file_info
+        finally:
+            # Consumer gone or done: let the workers exit
+            self.cancelled.set()
+            with self.cond:
+                self.cond.notify_all()
+
+
 class BackupEngine:
     def __init__(self):
         self.stop_event = threading.Event()
         self.pause_event = threading.Event()
         self.pause_event.set()  # Start unpaused
         self.current_status = "Ready"
+
+        # Parallel scan: total threads, and threads allowed on one physical disk
+        # at once, shared by its partitions (keep low for spinning disks, raise
+        # for NVMe/SSD; see ParallelScanner._disk_of)
+        self.scan_workers = 8
+        self.scan_workers_per_device = 2
+
+        # Concurrent copy (copy_files workers > 1): threads in total, and copies
+        # allowed at once per source device / on the destination device
+        self.copy_workers = 4
+        self.copy_workers_per_source_device = 2
+        self.copy_workers_per_destination_device = 4
+        self.copy_backend = CopyBackend(self)
+        # Default copy order (see CopyScheduler.POLICIES)
+        self.copy_schedule = "locality"
+
+        # Verification (copy_files verify=True): the source is hashed while it
+        # is copied; verify_readback re-reads the destination from the media
+        self.verify_algorithm = "blake2b"
+        self.verify_readback = True
+        self.verify_buffer_size = 4 * 1024 * 1024
+        # "sampled" tier: block size and number of random blocks per file
+        self.verify_sample_block = 64 * 1024
+        self.verify_sample_count = 8
+
+        # Local state (scan catalog, caches). Dot-folder, so never scanned itself.
+        self.data_dir = os.path.join(os.path.expanduser("~"), ".autobackup")
+        self.scan_catalog_path = os.path.join(self.data_dir, "scan_catalog.sqlite")
+        # Source digests reused across runs (see SourceHashCache)
+        self.hash_cache_path = os.path.join(self.data_dir, "hash_cache.sqlite")
+        self.hash_cache_max_entries = 500000
+        self.hash_cache = None
+
+        # copy_files pack_small=True: files below pack_threshold go into tar
+        # containers per category (see PackWriter), closed at pack_container_size
+        self.pack_threshold = 256 * 1024
+        self.pack_container_size = 1024 * 1024 * 1024
+
+        # copy_files compress=: "category" gzips every file of compress_categories,
+        # "auto" every file whose first compress_sample_size bytes shrink to
+        # compress_min_ratio or less (precompressed_categories are never tried)
+        self.compress_categories = {"Documenti"}
+        self.precompressed_categories = {"Immagini", "Video", "Audio", "Archivi"}
+        self.compress_level = 6
+        self.compress_sample_size = 64 * 1024
+        self.compress_min_ratio = 0.8
         
+        # Backup planning (plan_backup): categories in order of importance,
+        # the last ones are left out first when the destination is too small
+        self.category_priority = ["Documenti", "Immagini", "Audio", "Video", "Archivi", "Altro"]
+        self.plan_free_margin = 64 * 1024 * 1024
+
         # Default Categories
         self.categories = {
             "Documenti": [".doc", ".docx", ".pdf", ".txt", ".xlsx", ".xls", ".pptx", ".ppt", ".odt"],
@@ -89,18 +1820,253 @@ class BackupEngine:
                         pass
         return drives
 
-    def scan_files(self, source_drives, category_extensions_map, custom_extensions, exclusions, exceptions=None, progress_callback=None):
+    # Filesystems with a 4 GB - 1 byte file size limit (psutil fstype names)
+    FAT_FSTYPES = {"vfat", "fat", "fat16", "fat32", "msdos"}
+    FAT_MAX_FILE_SIZE = 4 * 1024**3 - 1
+
+    def plan_backup(self, files_list, drive, pack_small=False, incremental=False, dedup=False):
+        """
+        Checks a scanned file list against the destination before copying.
+        drive: an entry of get_removable_drives (mountpoint, fstype, free).
+        Space is estimated as the copy lays it out: every file and folder
+        rounded up to whole clusters (packed small files at their tar size).
+        Files over the FAT32 4 GB limit are set aside, then whole categories
+        are left out from the end of category_priority until the rest fits
+        in free space minus plan_free_margin (small categories dropped on the
+        way are taken back if they still fit). Compression only lowers the
+        real usage.
+        incremental / dedup: files unchanged since the latest snapshot on the
+        destination (Backup_* manifest, or the store's last tree and cached
+        source digests) take no space (see _unchanged_predicate).
+        Returns a dict: files (what to copy), estimated, free, cluster_size,
+        fstype, too_large (records), unchanged (count), dropped_categories,
+        dropped_files, fits.
+        """
+        cluster = self._cluster_size(drive['mountpoint'])
+        unchanged = self._unchanged_predicate(drive['mountpoint'], incremental, dedup)
+        fstype = (drive.get('fstype') or "").lower()
+        available = drive['free'] - self.plan_free_margin
+        max_size = self.FAT_MAX_FILE_SIZE if fstype in self.FAT_FSTYPES else None
+
+        def on_disk(size):
+            return -(-size // cluster) * cluster
+
+        files = FileRecordList() if isinstance(files_list, FileRecordList) else []
+        too_large = []
+        unchanged_count = 0
+        usage = {}       # category -> bytes on disk
+        folders = {}     # category -> set of destination folders
+        for file_info in files_list:
+            if max_size is not None and file_info['size'] > max_size:
+                too_large.append(file_info)
+                continue
+            files.append(file_info)
+            category = file_info['category']
+            usage.setdefault(category, 0)
+            if unchanged is not None and unchanged(file_info):
+                unchanged_count += 1
+                continue
+            if pack_small and file_info['size'] < self.pack_threshold:
+                # Tar header + data padded to 512-byte blocks
+                usage[category] = usage.get(category, 0) + 512 + -(-file_info['size'] // 512) * 512
+                continue
+            usage[category] = usage.get(category, 0) + on_disk(file_info['size'])
+            folder = os.path.dirname(file_info.get('root_label', "") + "/" + file_info['rel_path'].replace("\\", "/"))
+            folders.setdefault(category, set()).add(folder)
+
+        if dedup:
+            self._close_hash_cache()
+
+        def category_usage(category):
+            # Each folder also takes at least one cluster
+            return usage.get(category, 0) + len(folders.get(category, ())) * cluster
+
+        def rank(category):
+            if category in self.category_priority:
+                return self.category_priority.index(category)
+            return len(self.category_priority)
+
+        kept = sorted(usage, key=rank)
+        estimated = sum(category_usage(c) for c in kept)
+        dropped = []
+        while kept and estimated > available:
+            category = kept.pop()
+            dropped.append(category)
+            estimated -= category_usage(category)
+        # Categories dropped on the way that still fit in what is left come back
+        for category in sorted(dropped, key=rank):
+            if estimated + category_usage(category) <= available:
+                dropped.remove(category)
+                estimated += category_usage(category)
+
+        if dropped:
+            if isinstance(files, FileRecordList):
+                files = files.filter(exclude_categories=dropped)
+            else:
+                files = [f for f in files if f['category'] not in dropped]
+        return {
+            'files': files,
+            'estimated': estimated,
+            'free': drive['free'],
+            'cluster_size': cluster,
+            'fstype': fstype,
+            'too_large': too_large,
+            'unchanged': unchanged_count,
+            'dropped_categories': dropped,
+            'dropped_files': len(files_list) - len(files) - len(too_large),
+            'fits': estimated <= available,
+        }
+
+    def _unchanged_predicate(self, destination_root, incremental=False, dedup=False):
+        """
+        For plan_backup: predicate(file_info) that is True for files the copy
+        would only link or reference (unchanged since the latest snapshot),
+        or None when every file gets written.
+        """
+        if dedup:
+            store_root = os.path.join(str(destination_root), ObjectStore.DIR_NAME)
+            if not os.path.isdir(store_root):
+                return None
+            store = ObjectStore(store_root)
+            names = store.snapshot_names()
+            previous = store.load_tree(names[-1]) if names else {}
+            cache = self._get_hash_cache()
+
+            def unchanged(file_info):
+                try:
+                    st = os.stat(file_info['source'])
+                except OSError:
+                    return False
+                prev = previous.get(SnapshotManifest.key_for(file_info))
+                if prev and prev[0] == st.st_size and prev[1] == st.st_mtime_ns:
+                    return store.has(prev[2])
+                # Same content elsewhere in the store (only if already hashed once)
+                digest = cache.get(st, ObjectStore.HASH_NAME)
+                return digest is not None and store.has(digest)
+            return unchanged
+
+        if incremental:
+            previous = SnapshotManifest.previous_snapshot(destination_root, "Backup_", None)
+            if previous is None:
+                return None
+
+            def unchanged(file_info):
+                try:
+                    st = os.stat(file_info['source'])
+                except OSError:
+                    return False
+                key = SnapshotManifest.key_for(file_info)
+                return previous.unchanged_location(key, st.st_size, st.st_mtime_ns) is not None
+            return unchanged
+        return None
+
+    def _max_file_size(self, destination_root):
+        """FAT_MAX_FILE_SIZE if destination_root is on a FAT filesystem, else None."""
+        path = os.path.abspath(str(destination_root))
+        best = None
+        try:
+            partitions = psutil.disk_partitions(all=True)
+        except Exception:
+            return None
+        for part in partitions:
+            mount = part.mountpoint
+            if (path == mount or path.startswith(mount.rstrip("\\/") + os.sep)) and (best is None or len(mount) > len(best.mountpoint)):
+                best = part
+        if best is not None and (best.fstype or "").lower() in self.FAT_FSTYPES:
+            return self.FAT_MAX_FILE_SIZE
+        return None
+
+    def _cluster_size(self, mountpoint):
+        """Allocation unit of the destination filesystem (4 KB if unknown)."""
+        try:
+            if os.name == 'nt':
+                import ctypes
+                sectors = ctypes.c_ulong()
+                sector_bytes = ctypes.c_ulong()
+                free_clusters = ctypes.c_ulong()
+                total_clusters = ctypes.c_ulong()
+                ok = ctypes.windll.kernel32.GetDiskFreeSpaceW(
+                    ctypes.c_wchar_p(mountpoint), ctypes.byref(sectors), ctypes.byref(sector_bytes),
+                    ctypes.byref(free_clusters), ctypes.byref(total_clusters)
+                )
+                if ok:
+                    return sectors.value * sector_bytes.value
+            else:
+                st = os.statvfs(mountpoint)
+                return st.f_frsize or st.f_bsize
+        except (OSError, AttributeError):
+            pass
+        return 4096
+
+    def scan_files(self, source_drives, category_extensions_map, custom_extensions, exclusions, exceptions=None, progress_callback=None, parallel=False, incremental=False):
         """
         Scans drives for files matching criteria.
         category_extensions_map: dict { "CategoryName": [".ext1", ".ext2"] }
+        parallel: scan roots and large subtrees concurrently (see iter_scan).
+        incremental: reuse the scan catalog for unchanged folders (see iter_scan).
+        Returns (FileRecordList, total_size).
+        """
+        files_to_copy = FileRecordList()
+        total_size = 0
+
+        for file_info in self.iter_scan(source_drives, category_extensions_map, custom_extensions, exclusions, exceptions, progress_callback, parallel=parallel, incremental=incremental):
+            files_to_copy.append(file_info)
+            total_size += file_info['size']
+
+        if self.stop_event.is_set():
+            return FileRecordList(), 0
+
+        return files_to_copy, total_size
+
+    def iter_scan(self, source_drives, category_extensions_map, custom_extensions, exclusions, exceptions=None, progress_callback=None, parallel=False, incremental=False):
+        """
+        Same as scan_files, but yields each file record as soon as it is found.
+        Stops early (without error) when stop_event is set.
+        parallel: walk roots and subtrees on a thread pool (see ParallelScanner).
+                  Records then come in completion order, not os.walk order.
+        incremental: reuse listings of unchanged folders from the scan catalog
+                     (see ScanCatalog) and only re-list folders whose mtime changed.
         """
         if exceptions is None:
             exceptions = []
-            
-        files_to_copy = []
-        total_size = 0
-        
-        # Compile allowed extensions and mapping
+
+        allowed_exts, ext_to_cat = self._compile_extensions(category_extensions_map, custom_extensions)
+
+        # Compile exclusions/exceptions once for the whole scan
+        matcher = ExclusionMatcher(exclusions, exceptions)
+
+        # (start_path, drive_prefix_len, root_label) for every folder to walk
+        scan_roots = []
+        for drive in source_drives:
+            drive_path, root_label, start_paths = self._resolve_scan_root(drive)
+            drive_str = str(drive_path)
+            drive_prefix_len = len(drive_str) if drive_str.endswith(os.sep) else len(drive_str) + 1
+            for start_path in start_paths:
+                scan_roots.append((str(start_path), drive_prefix_len, root_label))
+
+        catalog = ScanCatalog(self.scan_catalog_path) if incremental else None
+        completed = False
+        try:
+            if parallel:
+                scanner = ParallelScanner(self, self.scan_workers, self.scan_workers_per_device)
+                for file_info in scanner.run(scan_roots, allowed_exts, ext_to_cat, matcher, catalog):
+                    yield file_info
+                    if progress_callback:
+                        progress_callback("scanning", os.path.basename(file_info['source']))
+            else:
+                for start_path, drive_prefix_len, root_label in scan_roots:
+                    for file_info in self._scan_tree(start_path, drive_prefix_len, root_label, allowed_exts, ext_to_cat, matcher, progress_callback, catalog):
+                        yield file_info
+                    if self.stop_event.is_set():
+                        return
+            completed = not self.stop_event.is_set()
+        finally:
+            if catalog is not None:
+                # Only forget folders that disappeared if the walk was complete
+                catalog.close([root[0] for root in scan_roots] if completed else None)
+
+    def _compile_extensions(self, category_extensions_map, custom_extensions):
+        """Returns (allowed_exts, ext_to_cat) for the selected filters."""
         allowed_exts = set()
         ext_to_cat = {}
         
@@ -115,254 +2081,1093 @@ class BackupEngine:
                 ext_to_cat[e] = "Altro"
                 
         allowed_exts = {e.lower() for e in allowed_exts}
+        return allowed_exts, ext_to_cat
 
-        for drive in source_drives:
-            drive_path = Path(drive)
-            root_label = ""
-            if platform.system() == 'Darwin':
-                p = drive_path.as_posix()
-                if p.startswith('/Volumes/'):
-                    parts = drive_path.parts
-                    root_label = parts[2] if len(parts) > 2 else "Volume"
-                else:
-                    home = Path(os.path.expanduser("~"))
-                    try:
-                        if drive_path == home or str(drive_path).startswith(str(home)):
-                            root_label = "Home"
-                    except Exception:
-                        root_label = ""
+    def _resolve_scan_root(self, drive):
+        """
+        Returns (drive_path, root_label, start_paths) for a source drive/folder.
+        root_label names the source inside the backup (drive letter, volume, Home).
+        """
+        drive_path = Path(drive)
+        root_label = ""
+        if platform.system() == 'Darwin':
+            p = drive_path.as_posix()
+            if p.startswith('/Volumes/'):
+                parts = drive_path.parts
+                root_label = parts[2] if len(parts) > 2 else "Volume"
             else:
-                root_label = drive_path.anchor.replace(":", "")
-            
-            # Special handling for System Drive (usually C:)
-            # If scanning C: ROOT, strictly limit to C:\Users
-            # If scanning a specific folder on C: (e.g. C:\Work), scan that folder.
-            limit_to_user_profile = False
-            
-            if os.name == 'nt' and os.getenv('SystemDrive'):
-                system_drive = os.getenv('SystemDrive').upper() # e.g. "C:"
-                current_drive_root = drive_path.anchor.rstrip('\\/') # e.g. "C:"
-                
-                # Check if the path matches the system drive
-                if current_drive_root.upper() == system_drive:
-                    # Check if we are scanning the ROOT of the drive
-                    # Comparison should be case-insensitive and ignore trailing slashes
-                    abs_input = os.path.abspath(drive).rstrip('\\/').upper()
-                    abs_root = os.path.abspath(drive_path.anchor).rstrip('\\/').upper()
-                    
-                    if abs_input == abs_root:
-                        limit_to_user_profile = True
-                    
-            start_paths = [drive_path]
-            if limit_to_user_profile:
-                # On system drive ROOT, only scan CURRENT User folder
-                # e.g. C:\Users\NomeUtente
+                home = Path(os.path.expanduser("~"))
                 try:
-                    user_path = Path(os.path.expanduser("~"))
-                    # Verify this user path is actually on the drive we are scanning
-                    if user_path.anchor.upper().rstrip('\\/') == current_drive_root.upper():
-                        start_paths = [user_path]
-                    else:
-                        # Fallback: if user profile is not on system drive (rare setup), scan Users root
-                        users_path = drive_path / "Users"
-                        start_paths = [users_path] if users_path.exists() else [drive_path]
+                    if drive_path == home or str(drive_path).startswith(str(home)):
+                        root_label = "Home"
                 except Exception:
-                    # Fallback on error
+                    root_label = ""
+        else:
+            # "C:\\" -> "C"; separators stripped so the label never makes the
+            # destination path absolute (POSIX "/" anchor, UNC shares)
+            root_label = drive_path.anchor.replace(":", "").strip("\\/")
+        
+        # Special handling for System Drive (usually C:)
+        # If scanning C: ROOT, strictly limit to C:\Users
+        # If scanning a specific folder on C: (e.g. C:\Work), scan that folder.
+        limit_to_user_profile = False
+        
+        if os.name == 'nt' and os.getenv('SystemDrive'):
+            system_drive = os.getenv('SystemDrive').upper() # e.g. "C:"
+            current_drive_root = drive_path.anchor.rstrip('\\/') # e.g. "C:"
+            
+            # Check if the path matches the system drive
+            if current_drive_root.upper() == system_drive:
+                # Check if we are scanning the ROOT of the drive
+                # Comparison should be case-insensitive and ignore trailing slashes
+                abs_input = os.path.abspath(drive).rstrip('\\/').upper()
+                abs_root = os.path.abspath(drive_path.anchor).rstrip('\\/').upper()
+                
+                if abs_input == abs_root:
+                    limit_to_user_profile = True
+                
+        start_paths = [drive_path]
+        if limit_to_user_profile:
+            # On system drive ROOT, only scan CURRENT User folder
+            # e.g. C:\Users\NomeUtente
+            try:
+                user_path = Path(os.path.expanduser("~"))
+                # Verify this user path is actually on the drive we are scanning
+                if user_path.anchor.upper().rstrip('\\/') == current_drive_root.upper():
+                    start_paths = [user_path]
+                else:
+                    # Fallback: if user profile is not on system drive (rare setup), scan Users root
                     users_path = drive_path / "Users"
                     start_paths = [users_path] if users_path.exists() else [drive_path]
-            
-            for start_path in start_paths:
-                for root, dirs, files in os.walk(start_path):
-                    # Check Stop/Pause
+            except Exception:
+                # Fallback on error
+                users_path = drive_path / "Users"
+                start_paths = [users_path] if users_path.exists() else [drive_path]
+
+        return drive_path, root_label, start_paths
+
+    def _scan_tree(self, start_path, drive_prefix_len, root_label, allowed_exts, ext_to_cat, matcher, progress_callback=None, catalog=None):
+        """
+        Walks start_path with os.scandir and yields matching file records.
+        Traversal order is the same as os.walk (top-down, listing order),
+        and symlinked folders are not followed.
+        """
+        # The start folder lists its subfolders even if it is excluded itself
+        stack = [(start_path, not matcher.is_excluded(start_path))]
+        while stack:
+            # Check Stop
+            if self.stop_event.is_set():
+                return
+
+            dir_path, include_files = stack.pop()
+            records, subdirs = self._scan_dir(dir_path, include_files, drive_prefix_len, root_label, allowed_exts, ext_to_cat, matcher, catalog)
+
+            for file_info in records:
+                yield file_info
+                if progress_callback:
+                    progress_callback("scanning", os.path.basename(file_info['source']))
+
+            # Depth-first in listing order, like os.walk
+            for child in reversed(subdirs):
+                stack.append((child, True))
+
+    def _scan_dir(self, dir_path, include_files, drive_prefix_len, root_label, allowed_exts, ext_to_cat, matcher, catalog=None):
+        """
+        Lists one folder. Returns (records, subdirs) where subdirs are the
+        non-excluded child folders to visit next.
+        Paths stay plain strings: types come from the DirEntry (no extra syscall),
+        sizes from DirEntry.stat() (free on Windows, one stat on POSIX), and
+        rel_path is sliced off the drive prefix instead of Path.relative_to.
+        """
+        if catalog is not None:
+            return self._scan_dir_cached(dir_path, include_files, drive_prefix_len, root_label, allowed_exts, ext_to_cat, matcher, catalog)
+
+        records = []
+        subdirs = []
+        dir_prefix = dir_path if dir_path.endswith(os.sep) else dir_path + os.sep
+        rel_prefix = dir_prefix[drive_prefix_len:]
+        is_nt = os.name == 'nt'
+
+        try:
+            with os.scandir(dir_path) as it:
+                entries = list(it)
+        except OSError:
+            return records, subdirs
+
+        for entry in entries:
+            name = entry.name
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+
+            if is_dir:
+                try:
+                    if entry.is_symlink():
+                        continue
+                except OSError:
+                    continue
+                hidden = None
+                if is_nt:
+                    hidden = _entry_is_hidden(entry)
+                child = dir_prefix + name
+                if not matcher.is_excluded(child, hidden):
+                    subdirs.append(child)
+                continue
+
+            if not include_files:
+                continue
+
+            # Same rule as Path.suffix ('.bashrc' and 'name.' have no suffix)
+            dot = name.rfind('.')
+            if dot <= 0 or dot == len(name) - 1:
+                continue
+            ext = name[dot:].lower()
+            if ext not in allowed_exts:
+                continue
+
+            try:
+                # Check size (might raise PermissionError)
+                size = entry.stat().st_size
+            except OSError:
+                continue
+
+            records.append({
+                'source': dir_prefix + name,
+                'size': size,
+                'category': ext_to_cat.get(ext, "Altro"),
+                'rel_path': rel_prefix + name,
+                'root_label': root_label
+            })
+
+        return records, subdirs
+
+    def _scan_dir_cached(self, dir_path, include_files, drive_prefix_len, root_label, allowed_exts, ext_to_cat, matcher, catalog):
+        """_scan_dir for incremental scans: listing comes from the catalog when the folder mtime is unchanged."""
+        records = []
+        subdirs = []
+        dir_prefix = dir_path if dir_path.endswith(os.sep) else dir_path + os.sep
+        rel_prefix = dir_prefix[drive_prefix_len:]
+
+        try:
+            # mtime taken BEFORE listing, so a change during the listing is seen next time
+            dir_mtime = os.stat(dir_path).st_mtime_ns
+        except OSError:
+            return records, subdirs
+
+        listing = catalog.get(dir_path, dir_mtime)
+        cached = listing is not None
+        if not cached:
+            listing = self._read_listing(dir_path, allowed_exts)
+            if listing is None:
+                return records, subdirs
+            catalog.put(dir_path, dir_mtime, listing[0], listing[1])
+        child_dirs, files = listing
+
+        for name, hidden in child_dirs:
+            child = dir_prefix + name
+            if not matcher.is_excluded(child, hidden if os.name == 'nt' else None):
+                subdirs.append(child)
+
+        if not include_files:
+            return records, subdirs
+
+        for name, size, mtime_ns in files:
+            dot = name.rfind('.')
+            if dot <= 0 or dot == len(name) - 1:
+                continue
+            ext = name[dot:].lower()
+            if ext not in allowed_exts:
+                continue
+            if cached or size is None:
+                # Cached listing: a file rewritten in place keeps the folder
+                # mtime, so its size is read again (a stat, no scandir)
+                try:
+                    size = os.stat(dir_prefix + name).st_size
+                except OSError:
+                    continue
+            records.append({
+                'source': dir_prefix + name,
+                'size': size,
+                'category': ext_to_cat.get(ext, "Altro"),
+                'rel_path': rel_prefix + name,
+                'root_label': root_label
+            })
+
+        return records, subdirs
+
+    def _read_listing(self, dir_path, allowed_exts):
+        """
+        Raw folder listing for the catalog: ([[name, hidden]], [[name, size, mtime_ns]]).
+        Only files with a selected extension are stat'ed (size None otherwise).
+        Returns None if the folder cannot be listed.
+        """
+        child_dirs = []
+        files = []
+        is_nt = os.name == 'nt'
+        try:
+            with os.scandir(dir_path) as it:
+                entries = list(it)
+        except OSError:
+            return None
+
+        for entry in entries:
+            name = entry.name
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+
+            if is_dir:
+                try:
+                    if entry.is_symlink():
+                        continue
+                except OSError:
+                    continue
+                child_dirs.append([name, _entry_is_hidden(entry) if is_nt else False])
+                continue
+
+            size = None
+            mtime_ns = None
+            dot = name.rfind('.')
+            if 0 < dot < len(name) - 1 and name[dot:].lower() in allowed_exts:
+                try:
+                    st = entry.stat()
+                    size = st.st_size
+                    mtime_ns = st.st_mtime_ns
+                except OSError:
+                    continue
+            files.append([name, size, mtime_ns])
+
+        return child_dirs, files
+
+    def _is_excluded(self, path, exclusions, exceptions=None):
+        """Check if path matches any exclusion criteria."""
+        # Hidden parts ('.' or '$' prefix), Windows hidden attribute, exclusion
+        # prefixes / folder names, then exceptions. See ExclusionMatcher.
+        return self._get_matcher(exclusions, exceptions).is_excluded(str(Path(path)))
+
+    def _get_matcher(self, exclusions, exceptions=None):
+        """Compiled matcher for these rules, reused while the rules do not change."""
+        key = (tuple(str(e) for e in exclusions), tuple(str(e) for e in (exceptions or [])))
+        cached = getattr(self, '_matcher_cache', None)
+        if cached is None or cached[0] != key:
+            cached = (key, ExclusionMatcher(exclusions, exceptions))
+            self._matcher_cache = cached
+        return cached[1]
+
+    def _get_category(self, ext):
+        for cat, exts in self.categories.items():
+            if ext in exts:
+                return cat
+        return "Altro"
+
+    def copy_files(self, files_list, destination_root, verify=True, progress_callback=None, incremental=False, dedup=False, workers=1, deferred_verify=None, pack_small=False, compress=None, schedule=None, resume=False):
+        """
+        Copies files to destination.
+        Structure: Destination / Category / DriveLetter_Structure / ...
+        files_list can be any iterable of file records (see stream_backup).
+        verify: False, "size" (size + mtime), "sampled" (head, tail and random
+                blocks compared), "full" (hash while copying + read-back), or
+                True (= "full"). "full" copies through Python buffers, never
+                the kernel copy path (see CopyBackend).
+        deferred_verify: None (inline), "parallel" or "after": checks run on a
+                background BackgroundVerifier during / after the copy and their
+                failures are added to the returned errors. Ignored with dedup,
+                where each content is checked before it enters the store.
+        incremental: files whose size and mtime match the previous Backup_* on
+                     the same destination are hardlinked to it (or, where the
+                     filesystem has no hardlinks, recorded as references in
+                     the snapshot manifest) instead of being copied again.
+        dedup: write to the content-addressed store instead (see ObjectStore);
+               identical contents are stored once across roots and snapshots.
+        workers: > 1 copies several files at once (see CopyPool).
+        pack_small: files below pack_threshold are appended to per-category
+                    tar containers with a side index (see PackWriter) instead
+                    of being written one by one; bigger files are copied as
+                    usual. Packed files are left out of the incremental
+                    manifest, so they are packed again on every run.
+                    Ignored with dedup.
+        compress: None, "category" or "auto" (True = "auto"): compressible
+                  files are stored as <name>.gz, one gzip per file so each
+                  restores on its own (any gunzip). Compression runs on the
+                  copy workers, so with workers > 1 it overlaps other files'
+                  reads and writes. Not applied to packed files or with dedup.
+        schedule: copy order policy (see CopyScheduler), default
+                  self.copy_schedule. Only lists are reordered; streamed
+                  iterables are copied as they arrive.
+        resume: continue the newest Backup_* left unfinished (see
+                SnapshotJournal) instead of starting a new one: files in its
+                journal that are unchanged at the source are skipped, the rest
+                (including any cut off halfway) are copied again. Ignored with
+                dedup, where a rerun already skips stored contents.
+        Files are written as <name>.autobackup.part and renamed into place
+        once complete, so a snapshot never holds a truncated file under its
+        real name.
+        Per-run counters are left in self.copy_stats, with the run time in
+        'elapsed' and the ordering figures in 'schedule'.
+        """
+        verify = self._verify_mode(verify)
+        if compress is True:
+            compress = "auto"
+        if compress not in (None, False, "category", "auto"):
+            raise ValueError(f"Unknown compress mode: {compress}")
+
+        started = time.time()
+        scheduler = None
+        if isinstance(files_list, (list, FileRecordList)):
+            scheduler = CopyScheduler(schedule or self.copy_schedule)
+            files_list = scheduler.order(files_list)
+
+        if dedup:
+            try:
+                return self._copy_to_store(files_list, destination_root, verify, progress_callback, workers)
+            finally:
+                self._finish_copy_stats(scheduler, started)
+
+        errors = []
+        stats = {'copied': 0, 'linked': 0, 'referenced': 0, 'packed': 0, 'compressed': 0, 'resumed': 0,
+                 'bytes_written': 0, 'io': self.copy_backend.reset_stats()}
+        stats_lock = threading.Lock()
+        self.copy_stats = stats
+
+        snapshot_name = f"Backup_{int(time.time())}"
+        done = None
+        if resume:
+            unfinished = SnapshotJournal.find_resumable(destination_root, "Backup_")
+            if unfinished is not None:
+                snapshot_name = unfinished
+                done, _ = SnapshotJournal.load(Path(destination_root) / snapshot_name)
+        dest_path = Path(destination_root) / snapshot_name
+        dest_path.mkdir(parents=True, exist_ok=True)
+        journal = SnapshotJournal(dest_path)
+        if done is not None:
+            # Leftovers of the interrupted run: partial files, open containers
+            self._remove_partial_files(dest_path)
+            PackWriter.discard_unfinished(dest_path, done)
+
+        manifest = None
+        previous = None
+        if incremental:
+            previous = SnapshotManifest.previous_snapshot(destination_root, "Backup_", snapshot_name)
+            manifest = SnapshotManifest(dest_path)
+
+        packer = None
+        if pack_small:
+            # Members are hashed while packed when the containers will be read back
+            algorithm = self.verify_algorithm if verify in ("sampled", "full") else None
+
+            def journal_members(category, members):
+                for member, size, mtime_ns in members:
+                    journal.add(f"{category}/{member}", size, mtime_ns)
+
+            packer = PackWriter(dest_path, self.pack_container_size, algorithm, journal_members)
+
+        verifier = None
+        if verify and deferred_verify:
+            verifier = BackgroundVerifier(self, verify)
+            if deferred_verify == "parallel":
+                verifier.start()
+
+        def target_of(file_info):
+            label = file_info.get('root_label', "")
+            return dest_path / file_info['category'] / label / Path(file_info['rel_path'])
+
+        def is_packed(file_info):
+            return packer is not None and file_info['size'] < self.pack_threshold
+
+        folders = DirectoryCreator(dest_path)
+        if isinstance(files_list, (list, FileRecordList)):
+            # Whole tree in one pass, before any file is written
+            folders.prepare((target_of(f).parent for f in files_list if not is_packed(f)), self.stop_event)
+
+        def copy_one(file_info):
+            src = Path(file_info['source'])
+            dst = target_of(file_info)
+            key = SnapshotManifest.key_for(file_info)
+            file_errors = []
+
+            try:
+                src_stat = src.stat()
+                if done is not None and done.get(key) == (src_stat.st_size, src_stat.st_mtime_ns):
+                    # Finished by the interrupted run and unchanged since
+                    with stats_lock:
+                        stats['resumed'] += 1
+                    return True, file_errors
+
+                if is_packed(file_info):
+                    if src_stat.st_size < self.pack_threshold:
+                        member = SnapshotManifest.key_for(file_info).split("/", 1)[1]
+                        packer.add(file_info['category'], member, src, src_stat)
+                        with stats_lock:
+                            stats['packed'] += 1
+                            stats['bytes_written'] += src_stat.st_size
+                        return True, file_errors
+
+                folders.ensure(dst.parent)
+
+                if manifest is not None:
+                    reused = self._reuse_previous(previous, key, src_stat.st_size, src_stat.st_mtime_ns, dst)
+                    if reused is not None:
+                        # Unchanged since the previous snapshot: no bytes written
+                        outcome, codec = reused
+                        manifest.add(key, src_stat.st_size, src_stat.st_mtime_ns, outcome, codec)
+                        journal.add(key, src_stat.st_size, src_stat.st_mtime_ns)
+                        with stats_lock:
+                            stats['linked' if outcome == "" else 'referenced'] += 1
+                        return True, file_errors
+
+                digest = None
+                written = None
+                codec = "gzip" if compress and self._should_compress(compress, file_info) else None
+                if codec:
+                    dst = dst.with_name(dst.name + ".gz")
+                part = dst.with_name(dst.name + ".autobackup.part")
+                if codec:
+                    digest, written, stored_size = self._compress_file(src, part)
+                    with stats_lock:
+                        stats['compressed'] += 1
+                        stats['bytes_written'] += stored_size
+                elif verify == "full":
+                    # Source hashed while it is written: no second read of the source
+                    digest, written = self._copy_file_hashed(src, part)
+                else:
+                    self._copy_file(src, part)
+                os.replace(part, dst)
+                if not codec:
+                    with stats_lock:
+                        stats['copied'] += 1
+                        stats['bytes_written'] += file_info['size']
+
+                if verifier is not None:
+                    verifier.submit(src, dst, digest, written, codec, key)
+                elif verify:
+                    if not self._check_copy(verify, src, dst, digest, written, codec):
+                        # Left out of the journal: a resumed run copies it again
+                        file_errors.append(f"Integrity check failed: {src}")
+
+                if not file_errors:
+                    # A bad copy must not be reused by later incremental runs
+                    if manifest is not None:
+                        manifest.add(key, src_stat.st_size, src_stat.st_mtime_ns, codec=codec)
+                    journal.add(key, src_stat.st_size, src_stat.st_mtime_ns)
+
+                return True, file_errors
+
+            except CopyInterrupted:
+                return False, file_errors
+            except Exception as e:
+                file_errors.append(f"Error copying {src}: {str(e)}")
+                return False, file_errors
+
+        finished = False
+        try:
+            copied_count, run_errors = self._run_copy(files_list, copy_one, progress_callback, workers)
+            errors.extend(run_errors)
+            finished = not self.stop_event.is_set()
+        finally:
+            if verifier is not None:
+                # "after": starts now; "parallel": drains what is left
+                errors.extend(verifier.finish(progress_callback))
+            if manifest is not None:
+                if verifier is not None:
+                    for key in verifier.failed:
+                        manifest.remove(key)
+                manifest.close()
+            if packer is not None:
+                packer.close()
+                if packer.algorithm and not self.stop_event.is_set():
+                    if progress_callback:
+                        progress_callback("verifying", "archivi", 0)
+                    for key in packer.verify(self.stop_event):
+                        errors.append(f"Integrity check failed: {key}")
+            journal.close(complete=finished)
+            self._close_hash_cache()
+            self._finish_copy_stats(scheduler, started)
+
+        return copied_count, errors
+
+    @staticmethod
+    def _remove_partial_files(snapshot_path):
+        """Deletes the *.autobackup.part files an interrupted run left behind."""
+        for folder, _, names in os.walk(str(snapshot_path)):
+            for name in names:
+                if name.endswith(".autobackup.part"):
+                    try:
+                        os.remove(os.path.join(folder, name))
+                    except OSError:
+                        pass
+
+    def find_unfinished_backup(self, destination_root):
+        """Name of the Backup_* copy_files(resume=True) would continue, or None."""
+        return SnapshotJournal.find_resumable(destination_root, "Backup_")
+
+    def _finish_copy_stats(self, scheduler, started):
+        self.copy_stats['elapsed'] = time.time() - started
+        self.copy_stats['schedule'] = scheduler.stats if scheduler is not None else {'policy': "walk"}
+
+    def _run_copy(self, files_list, copy_one, progress_callback=None, workers=1):
+        """
+        Drives copy_one(file_info) -> (ok, errors) over files_list, serially or
+        on a CopyPool when workers > 1. Returns (copied_count, errors).
+        ok may also be a (file_count, bytes) pair, for work items that stand
+        for several files and may copy only part of them (see
+        AndroidBackupEngine batches).
+        """
+        if workers > 1:
+            pool = CopyPool(self, workers, self.copy_workers_per_source_device, self.copy_workers_per_destination_device)
+            return pool.run(files_list, copy_one, progress_callback)
+
+        copied_count = 0
+        copied_size = 0
+        errors = []
+        for file_info in files_list:
+            # Check Pause
+            self.pause_event.wait()
+
+            # Check Stop
+            if self.stop_event.is_set():
+                break
+
+            if progress_callback:
+                progress_callback("copying", os.path.basename(file_info['source']), copied_size)
+
+            ok, file_errors = copy_one(file_info)
+            errors.extend(file_errors)
+            count, size = self._copied_amount(file_info, ok)
+            copied_count += count
+            copied_size += size
+
+        return copied_count, errors
+
+    @staticmethod
+    def _copied_amount(file_info, ok):
+        """(files, bytes) copied for one copy_one result (see _run_copy)."""
+        if isinstance(ok, tuple):
+            return ok
+        return (1, file_info['size']) if ok else (0, 0)
+
+    def _reuse_previous(self, previous, key, size, mtime_ns, dst):
+        """
+        Links an unchanged file to the previous snapshot.
+        Returns (outcome, codec): outcome is "" if dst was hardlinked, or the
+        snapshot-relative location of the bytes if only a manifest reference
+        was recorded; codec is how the previous copy is stored. Returns None
+        if the file must be copied.
+        """
+        if previous is None:
+            return None
+        found = previous.unchanged_location(key, size, mtime_ns)
+        if found is None:
+            return None
+        location, codec = found
+        if codec:
+            dst = dst.with_name(dst.name + ".gz")
+
+        if previous.links_supported:
+            try:
+                os.link(os.path.join(previous.destination_root, location), dst)
+                return "", codec
+            except (FileNotFoundError, FileExistsError):
+                # Previous copy gone (or dst already there): copy again
+                return None
+            except OSError as e:
+                if not self._links_unsupported(e):
+                    # Too many links to this file (NTFS: 1023), permissions...: start a fresh copy
+                    return None
+                # FAT/exFAT and friends: no hardlinks, fall back to references
+                previous.links_supported = False
+
+        return location, codec
+
+    @staticmethod
+    def _links_unsupported(e):
+        """True if an os.link error means the destination has no hardlinks at all."""
+        if e.errno in (errno.EXDEV, errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP, errno.ENOSYS):
+            return True
+        # Windows: ERROR_INVALID_FUNCTION / ERROR_NOT_SUPPORTED (FAT, exFAT)
+        return getattr(e, 'winerror', None) in (1, 50)
+
+    def _copy_to_store(self, files_list, destination_root, verify=True, progress_callback=None, workers=1):
+        """copy_files for the deduplicating store. Returns (copied_count, errors)."""
+        stats = {'copied': 0, 'deduplicated': 0, 'bytes_written': 0, 'io': self.copy_backend.reset_stats()}
+        stats_lock = threading.Lock()
+        self.copy_stats = stats
+
+        store = ObjectStore(os.path.join(str(destination_root), ObjectStore.DIR_NAME))
+        snapshot_name = f"Backup_{int(time.time())}"
+        previous_names = [n for n in store.snapshot_names() if n != snapshot_name]
+        previous = store.load_tree(previous_names[-1]) if previous_names else {}
+        tree = store.open_tree(snapshot_name)
+        self._get_hash_cache()
+
+        def copy_and_hash(src, dst):
+            # Checked before the object enters the store, where every later
+            # snapshot would reuse it
+            digest = self._copy_with_hash(src, dst, ObjectStore.HASH_NAME)
+            if verify == "full":
+                ok = not self.verify_readback or self._read_back_hash(dst, ObjectStore.HASH_NAME) == digest
+            elif verify == "sampled":
+                ok = self._verify_sampled(src, dst)
+            elif verify == "size":
+                # Objects carry no mtime
+                ok = os.path.getsize(src) == os.path.getsize(dst)
+            else:
+                ok = True
+            if not ok:
+                raise IOError("Integrity check failed")
+            return digest
+
+        def copy_one(file_info):
+            src = file_info['source']
+            key = SnapshotManifest.key_for(file_info)
+            try:
+                st = os.stat(src)
+                digest = None
+                prev = previous.get(key)
+                if prev and prev[0] == st.st_size and prev[1] == st.st_mtime_ns and store.has(prev[2]):
+                    # Unchanged since the last snapshot: no need to read it
+                    digest = prev[2]
+                else:
+                    # Hash first so duplicates are never written to the (slow) destination
+                    candidate = self._source_hash(src, ObjectStore.HASH_NAME, st)
+                    if store.has(candidate):
+                        digest = candidate
+
+                stored = False
+                if digest is None:
+                    digest, stored = store.put(src, copy_and_hash)
+                    self._remember_hash(st, ObjectStore.HASH_NAME, digest)
+                with stats_lock:
+                    if stored:
+                        stats['copied'] += 1
+                        stats['bytes_written'] += st.st_size
+                    else:
+                        stats['deduplicated'] += 1
+                    tree.write(json.dumps({'path': key, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'hash': digest}) + "\n")
+                return True, []
+
+            except CopyInterrupted:
+                return False, []
+            except Exception as e:
+                return False, [f"Error copying {src}: {str(e)}"]
+
+        try:
+            return self._run_copy(files_list, copy_one, progress_callback, workers)
+        finally:
+            tree.close()
+            self._close_hash_cache()
+
+    def restore_snapshot(self, destination_root, snapshot_name, target_root, progress_callback=None):
+        """
+        Rebuilds a snapshot of the deduplicating store as plain folders:
+        target_root / Categoria / root_label / rel_path, with original mtimes.
+        snapshot_name: e.g. "Backup_1700000000" (None = latest).
+        Returns (restored_count, errors).
+        """
+        store = ObjectStore(os.path.join(str(destination_root), ObjectStore.DIR_NAME))
+        if snapshot_name is None:
+            names = store.snapshot_names()
+            if not names:
+                return 0, ["No snapshot found"]
+            snapshot_name = names[-1]
+
+        restored = 0
+        restored_size = 0
+        errors = []
+        os.makedirs(str(target_root), exist_ok=True)
+        folders = DirectoryCreator(target_root)
+        for key, (size, mtime_ns, digest) in store.load_tree(snapshot_name).items():
+            self.pause_event.wait()
+            if self.stop_event.is_set():
+                break
+            dst = os.path.join(str(target_root), *key.split("/"))
+            try:
+                if progress_callback:
+                    progress_callback("restoring", os.path.basename(dst), restored_size)
+                folders.ensure(os.path.dirname(dst))
+                shutil.copyfile(store.object_path(digest), dst)
+                os.utime(dst, ns=(mtime_ns, mtime_ns))
+                restored += 1
+                restored_size += size
+            except Exception as e:
+                errors.append(f"Error restoring {key}: {str(e)}")
+        if progress_callback:
+            progress_callback("restoring", "", restored_size)
+        return restored, errors
+
+    def restore_folder_snapshot(self, destination_root, snapshot_name, target_root, progress_callback=None):
+        """
+        Copies a Backup_* snapshot with a manifest to target_root as plain
+        files: manifest references (incremental runs on FAT/exFAT) are read
+        from the snapshot that holds the bytes, .gz copies are decompressed,
+        original mtimes are restored. Files packed in .tar containers (not in
+        the manifest) are extracted through their side indexes.
+        Returns (restored_count, errors).
+        """
+        snapshot_path = os.path.join(str(destination_root), snapshot_name)
+        entries = SnapshotManifest.load(snapshot_path)
+        if entries is None:
+            return 0, [f"No manifest in {snapshot_name}"]
+
+        restored = 0
+        restored_size = 0
+        errors = []
+        os.makedirs(str(target_root), exist_ok=True)
+        folders = DirectoryCreator(target_root)
+        for key, (size, mtime_ns, ref, codec) in entries.items():
+            self.pause_event.wait()
+            if self.stop_event.is_set():
+                break
+            if ref:
+                src = os.path.join(str(destination_root), *ref.split("/"))
+            else:
+                src = os.path.join(snapshot_path, *key.split("/")) + (".gz" if codec else "")
+            dst = os.path.join(str(target_root), *key.split("/"))
+            try:
+                if progress_callback:
+                    progress_callback("restoring", os.path.basename(dst), restored_size)
+                folders.ensure(os.path.dirname(dst))
+                if codec == "gzip":
+                    with gzip.open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                        shutil.copyfileobj(fsrc, fdst, self.verify_buffer_size)
+                else:
+                    shutil.copyfile(src, dst)
+                if mtime_ns is not None:
+                    os.utime(dst, ns=(mtime_ns, mtime_ns))
+                restored += 1
+                restored_size += size
+            except Exception as e:
+                errors.append(f"Error restoring {key}: {str(e)}")
+
+        for category, container in PackWriter.containers(snapshot_path):
+            try:
+                members = PackWriter.read_index(container)
+                with open(container, "rb") as fsrc:
+                    for entry in members:
+                        self.pause_event.wait()
+                        if self.stop_event.is_set():
+                            return restored, errors
+                        key = f"{category}/{entry['path']}"
+                        dst = os.path.join(str(target_root), *key.split("/"))
+                        try:
+                            if progress_callback:
+                                progress_callback("restoring", os.path.basename(dst), restored_size)
+                            folders.ensure(os.path.dirname(dst))
+                            fsrc.seek(entry['offset'])
+                            with open(dst, "wb") as fdst:
+                                fdst.write(fsrc.read(entry['size']))
+                            os.utime(dst, ns=(entry['mtime_ns'], entry['mtime_ns']))
+                            restored += 1
+                            restored_size += entry['size']
+                        except Exception as e:
+                            errors.append(f"Error restoring {key}: {str(e)}")
+            except Exception as e:
+                errors.append(f"Error restoring {container}: {str(e)}")
+        if progress_callback:
+            progress_callback("restoring", "", restored_size)
+        return restored, errors
+
+    def stream_backup(self, source_drives, category_extensions_map, custom_extensions, exclusions, destination_root, exceptions=None,
+                      verify=True, progress_callback=None, parallel=False, incremental_scan=False, queue_size=1000, max_per_category=None, **copy_options):
+        """
+        Scan and copy at the same time: a scanner thread feeds a bounded queue
+        that copy_files consumes, so the destination starts writing right away.
+        Besides the usual "copying" events, progress_callback receives
+        ("scanned", "", found_size) whenever the running total grows, so the
+        total and the ETA can follow the scan.
+        incremental_scan: use the scan catalog (scan_files incremental=True).
+        max_per_category: keep only the first N files per category (test mode).
+        copy_options: passed to copy_files (e.g. incremental=True).
+        Returns (copied_count, errors, scanned_count, scanned_size).
+        """
+        file_queue = Queue(maxsize=queue_size)
+        scan_state = {'count': 0, 'size': 0, 'done': False}
+        scan_errors = []
+        # No plan_backup here: files over the FAT32 limit are skipped as they come
+        max_size = self._max_file_size(destination_root)
+
+        def producer():
+            cat_counts = {}
+            scan_iter = self.iter_scan(source_drives, category_extensions_map, custom_extensions, exclusions, exceptions, parallel=parallel, incremental=incremental_scan)
+            try:
+                for file_info in scan_iter:
+                    # Check Pause/Stop
+                    self.pause_event.wait()
                     if self.stop_event.is_set():
-                        return [], 0
-                    
-                    # 1. Prune subdirectories
-                    dirs[:] = [d for d in dirs if not self._is_excluded(Path(root) / d, exclusions, exceptions)]
-                    
-                    # 2. Check if CURRENT root is excluded
-                    if self._is_excluded(Path(root), exclusions, exceptions):
+                        break
+
+                    if max_size is not None and file_info['size'] > max_size:
+                        scan_errors.append(f"Skipped {file_info['source']}: larger than 4 GB (FAT32)")
                         continue
 
-                    for file in files:
-                        try:
-                            file_path = Path(root) / file
-                            ext = file_path.suffix.lower()
-                            
-                            if ext in allowed_exts:
-                                # Check size (might raise PermissionError)
-                                stat = file_path.stat()
-                                size = stat.st_size
-                                category = ext_to_cat.get(ext, "Altro")
-                                
-                                files_to_copy.append({
-                                    'source': str(file_path),
-                                    'size': size,
-                                    'category': category,
-                                    'rel_path': str(file_path.relative_to(drive_path)),
-                                    'root_label': root_label
-                                })
-                                total_size += size
-                                
-                                if progress_callback:
-                                    progress_callback("scanning", file_path.name)
-                        except Exception:
-                            continue
+                    if max_per_category is not None:
+                        cat = file_info['category']
+                        count = cat_counts.get(cat, 0)
+                        if count >= max_per_category:
+                            continue
+                        cat_counts[cat] = count + 1
+
+                    # Bounded queue: block while the copy is behind, but stay stoppable
+                    while not self.stop_event.is_set():
+                        try:
+                            file_queue.put(file_info, timeout=0.2)
+                            break
+                        except Full:
+                            continue
+                    scan_state['count'] += 1
+                    scan_state['size'] += file_info['size']
+            except Exception as e:
+                scan_errors.append(f"Error scanning: {e}")
+            finally:
+                scan_iter.close()
+                scan_state['done'] = True
+
+        def consume():
+            reported_size = -1
+            last_report = 0
+            while True:
+                # Throttled "scanned" updates (also while waiting for the scanner)
+                now = time.time()
+                if progress_callback and scan_state['size'] != reported_size and (scan_state['done'] or now - last_report >= 0.5):
+                    reported_size = scan_state['size']
+                    last_report = now
+                    progress_callback("scanned", "", reported_size)
+
+                try:
+                    file_info = file_queue.get(timeout=0.2)
+                except Empty:
+                    if self.stop_event.is_set():
+                        return
+                    if scan_state['done'] and file_queue.empty():
+                        if progress_callback and scan_state['size'] != reported_size:
+                            progress_callback("scanned", "", scan_state['size'])
+                        return
+                    continue
+                yield file_info
+
+        scanner = threading.Thread(target=producer, daemon=True)
+        scanner.start()
 
-        return files_to_copy, total_size
+        copied_count, errors = self.copy_files(consume(), destination_root, verify=verify, progress_callback=progress_callback, **copy_options)
 
-    def _is_excluded(self, path, exclusions, exceptions=None):
-        """Check if path matches any exclusion criteria."""
-        path = Path(path)
-        if exceptions is None:
-            exceptions = []
-        
-        # Check hidden attribute (Windows) or dotfile (Unix/Windows)
-        # Note: On Windows, checking FILE_ATTRIBUTE_HIDDEN is more robust, but stat().st_file_attributes is platform dependent.
-        # For cross-platform simplicity, we check if any part starts with '.' (common convention)
-        # AND on Windows specifically we can try to check the attribute if needed, but 'os.walk' doesn't give us attributes directly.
-        # Let's implement a basic check: skip if name starts with '.' OR if we can detect hidden attribute.
-        
-        # 1. Check if any part of the path starts with '.' (covers .git, .venv, etc.) or '$' (system/hidden/temp)
-        for part in path.parts:
-            if part.startswith('.') or part.startswith('$'):
-                return True
+        scanner.join()
+        return copied_count, scan_errors + errors, scan_state['count'], scan_state['size']
 
-        # 2. Check Windows hidden attribute for the path itself (if it exists)
-        if os.name == 'nt':
-            try:
-                import stat
-                if path.exists():
-                    attrs = path.stat().st_file_attributes
-                    if attrs & stat.FILE_ATTRIBUTE_HIDDEN:
-                        return True
-            except Exception:
-                pass
+    def _verify_mode(self, verify):
+        """Normalizes copy_files' verify argument to None, "size", "sampled" or "full"."""
+        if verify is True:
+            return "full"
+        if not verify:
+            return None
+        if verify not in ("size", "sampled", "full"):
+            raise ValueError(f"Unknown verify mode: {verify}")
+        return verify
 
-        # Check system folder names (exact match on parts)
-        # Note: This is now handled via passed 'exclusions' list for flexibility, 
-        # but we keep this check if user didn't override the list to be safe.
-        # However, to allow user to Remove system folders from exclusion, we rely on the passed list.
-        # If the passed list is empty, we might assume no exclusions, but usually it will contain at least defaults.
-        # To be safe, we check if the exclusion list matches one of the system folders.
-        
-        # Check custom exclusions (path starts with exclusion)
-        path_str = str(path).lower()
-        is_excluded = False
-        
-        for excl in exclusions:
-            excl_str = str(excl).lower()
-            # Check if exclusion is a direct parent or match
-            # We use startswith on string representation for simple tree exclusion
-            if path_str.startswith(excl_str):
-                is_excluded = True
-                break
-                
-            # Also check if a specific part matches the exclusion (for folder names like 'Windows' appearing anywhere)
-            if os.sep not in excl_str and '/' not in excl_str:
-                 for part in path.parts:
-                     if part.lower() == excl_str:
-                         is_excluded = True
-                         break
-            
-            if is_excluded:
-                break
+    def _check_copy(self, mode, src, dst, digest=None, written=None, codec=None):
+        """Runs one verification tier on a finished copy."""
+        if codec:
+            return self._verify_compressed(mode, dst, digest, written)
+        if mode == "size":
+            return self._verify_size_mtime(src, dst)
+        if mode == "sampled":
+            return self._verify_sampled(src, dst)
+        if digest is not None:
+            return self._verify_copy(dst, digest, written)
+        return self._verify_file(Path(src), Path(dst))
 
-        if not is_excluded:
+    def _verify_size_mtime(self, src, dst):
+        """Cheapest tier: same size, and mtime kept by copystat (FAT: 2 s resolution)."""
+        src_stat = os.stat(src)
+        dst_stat = os.stat(dst)
+        return src_stat.st_size == dst_stat.st_size and abs(src_stat.st_mtime - dst_stat.st_mtime) <= 2
+
+    def _verify_sampled(self, src, dst):
+        """
+        Compares the first and last block plus verify_sample_count random blocks
+        of source and destination (destination read from the media).
+        Small files are compared whole.
+        """
+        size = os.path.getsize(src)
+        if os.path.getsize(dst) != size:
             return False
+        block = self.verify_sample_block
+        if size <= block * (self.verify_sample_count + 2):
+            offsets = range(0, size, block)
+        else:
+            rng = random.Random()
+            offsets = {0, size - block}
+            offsets.update(rng.randrange(0, size - block) for _ in range(self.verify_sample_count))
+            offsets = sorted(offsets)
 
-        # If excluded, check if it is saved by an exception (inclusion)
-        # 1. Is path a parent of an exception? (We must traverse it to find the exception)
-        # 2. Is path the exception itself or inside it?
-        
-        for exc in exceptions:
-            exc_path = Path(exc)
-            
-            # Case 1: Path is parent of Exception
-            # e.g. Path=/A, Exc=/A/B
-            try:
-                exc_path.relative_to(path)
-                return False # Don't exclude, we need to go deeper
-            except ValueError:
-                pass
-            
-            # Case 2: Path is inside Exception (or is Exception)
-            # e.g. Path=/A/B/C, Exc=/A/B
-            try:
-                path.relative_to(exc_path)
-                return False # It is explicitly included
-            except ValueError:
-                pass
-                
+        with open(src, "rb", buffering=0) as fsrc, open(dst, "rb", buffering=0) as fdst:
+            _drop_page_cache(fdst.fileno(), flush=True)
+            for offset in offsets:
+                fsrc.seek(offset)
+                fdst.seek(offset)
+                if fsrc.read(block) != fdst.read(block):
+                    return False
+            _drop_page_cache(fdst.fileno())
         return True
 
-    def _get_category(self, ext):
-        for cat, exts in self.categories.items():
-            if ext in exts:
-                return cat
-        return "Altro"
-
-    def copy_files(self, files_list, destination_root, verify=True, progress_callback=None):
+    def _verify_compressed(self, mode, dst, digest, written):
         """
-        Copies files to destination.
-        Structure: Destination / Category / DriveLetter_Structure / ...
+        Checks a file written by _compress_file. "size" reads the length
+        stored in the gzip trailer; the other tiers decompress the copy as
+        read from the media (gzip has no random access to sample).
         """
-        copied_count = 0
-        copied_size = 0
-        errors = []
-
-        dest_path = Path(destination_root) / f"Backup_{int(time.time())}"
-        dest_path.mkdir(parents=True, exist_ok=True)
+        if mode == "size":
+            with open(dst, "rb") as f:
+                f.seek(-4, os.SEEK_END)
+                return int.from_bytes(f.read(4), "little") == written & 0xFFFFFFFF
+        h = hashlib.new(self.verify_algorithm)
+        total = 0
+        with open(dst, "rb", buffering=0) as raw:
+            _drop_page_cache(raw.fileno(), flush=True)
+            try:
+                with gzip.GzipFile(fileobj=raw, mode="rb") as gz:
+                    for chunk in iter(lambda: gz.read(self.verify_buffer_size), b""):
+                        h.update(chunk)
+                        total += len(chunk)
+            except (OSError, EOFError, zlib.error):
+                return False  # corrupted stream
+            _drop_page_cache(raw.fileno())
+        return total == written and h.hexdigest() == digest
 
-        for file_info in files_list:
-            # Check Pause
-            self.pause_event.wait()
-            
-            # Check Stop
-            if self.stop_event.is_set():
-                break
+    def _should_compress(self, mode, file_info):
+        """Whether copy_files compress=mode stores this file gzipped."""
+        category = file_info['category']
+        if mode == "category":
+            return category in self.compress_categories
+        if category in self.precompressed_categories:
+            return False
+        with open(file_info['source'], "rb") as f:
+            sample = f.read(self.compress_sample_size)
+        # Level 1 is enough to tell text from already-compressed data
+        return bool(sample) and len(zlib.compress(sample, 1)) <= len(sample) * self.compress_min_ratio
 
-            src = Path(file_info['source'])
-            label = file_info.get('root_label', "")
-            target_structure = Path(file_info['rel_path'])
-            dst = dest_path / file_info['category'] / label / target_structure
-            
-            try:
-                dst.parent.mkdir(parents=True, exist_ok=True)
-                
-                if progress_callback:
-                    progress_callback("copying", src.name, copied_size)
+    def _compress_file(self, src, dst):
+        """
+        Stores src gzipped at dst, hashing the source bytes on the way.
+        Returns (digest, bytes_read, compressed_size).
+        """
+        h = hashlib.new(self.verify_algorithm)
+        read = [0]
 
-                shutil.copy2(src, dst)
-                
-                if verify:
-                    if not self._verify_file(src, dst):
-                        errors.append(f"Integrity check failed: {src}")
-                
-                copied_count += 1
-                copied_size += file_info['size']
-                
-            except Exception as e:
-                errors.append(f"Error copying {src}: {str(e)}")
+        def on_chunk(chunk):
+            h.update(chunk)
+            read[0] += len(chunk)
 
-        return copied_count, errors
+        stored_size = self.copy_backend.compress(src, dst, on_chunk, self.compress_level)
+        shutil.copystat(src, dst)
+        return h.hexdigest(), read[0], stored_size
 
     def _verify_file(self, src, dst):
         """Simple size check + optional hash check for critical verification."""
         # Fast check: Size
         if src.stat().st_size != dst.stat().st_size:
             return False
-        # Deep check: MD5 (optional, can be slow for large files)
-        # For this tool, we'll do a partial hash or full hash depending on requirements.
-        # Let's do a full hash for safety as requested.
-        return self._get_hash(src) == self._get_hash(dst)
+        # Deep check: full hash of both files, destination read from the media
+        return self._source_hash(src, self.verify_algorithm) == self._read_back_hash(dst, self.verify_algorithm)
+
+    def _get_hash_cache(self):
+        if self.hash_cache is None:
+            self.hash_cache = SourceHashCache(self.hash_cache_path, self.hash_cache_max_entries)
+        return self.hash_cache
+
+    def _close_hash_cache(self):
+        if self.hash_cache is not None:
+            self.hash_cache.close()
+            self.hash_cache = None
+
+    def _source_hash(self, path, algorithm, st=None):
+        """Digest of a source file, from the hash cache when it is unchanged."""
+        if st is None:
+            st = os.stat(path)
+        cache = self._get_hash_cache()
+        digest = cache.get(st, algorithm)
+        if digest is None:
+            digest = self._hash_file(path, algorithm)
+            cache.put(st, algorithm, digest)
+        return digest
+
+    def _remember_hash(self, st, algorithm, digest):
+        """Stores a digest computed elsewhere (e.g. while copying) in the hash cache."""
+        self._get_hash_cache().put(st, algorithm, digest)
+
+    def _copy_file_hashed(self, src, dst):
+        """
+        _copy_file that also hashes the source bytes as they are written.
+        Returns (digest, bytes_written).
+        """
+        h = hashlib.new(self.verify_algorithm)
+        written = [0]
+
+        def on_chunk(chunk):
+            h.update(chunk)
+            written[0] += len(chunk)
+
+        self._copy_chunks(src, dst, on_chunk)
+        shutil.copystat(src, dst)
+        return h.hexdigest(), written[0]
+
+    def _verify_copy(self, dst, digest, written):
+        """
+        Checks a copy made by _copy_file_hashed: size always, and with
+        verify_readback the destination is read back from the media and hashed.
+        """
+        if os.path.getsize(dst) != written:
+            return False
+        if not self.verify_readback:
+            return True
+        return self._read_back_hash(dst, self.verify_algorithm) == digest
+
+    def _read_back_hash(self, path, algorithm):
+        """
+        Hashes a freshly written file as stored on the device: the data is
+        flushed and dropped from the page cache first (posix_fadvise on Linux,
+        F_NOCACHE on macOS) so the check does not just read back RAM.
+        On Windows the file is read normally.
+        """
+        h = hashlib.new(algorithm)
+        with open(path, "rb", buffering=0) as f:
+            fd = f.fileno()
+            # Sized to the file: small files do not pay for a large buffer
+            buf = bytearray(min(self.verify_buffer_size, max(os.fstat(fd).st_size, CopyBackend.MIN_BUFFER)))
+            view = memoryview(buf)
+            _drop_page_cache(fd, flush=True)
+            while True:
+                n = f.readinto(view)
+                if not n:
+                    break
+                h.update(view[:n])
+            # Do not leave the backup data in the cache either
+            _drop_page_cache(fd)
+        return h.hexdigest()
 
-    def _get_hash(self, path):
-        hash_md5 = hashlib.md5()
+    def _hash_file(self, path, algorithm="sha256"):
+        h = hashlib.new(algorithm)
         with open(path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def _copy_file(self, src, dst):
+        """
+        copy2 in chunks: pause_event/stop_event are honoured between chunks,
+        and a copy stopped halfway is removed (raises CopyInterrupted).
+        """
+        self._copy_chunks(src, dst)
+        shutil.copystat(src, dst)
+
+    def _copy_with_hash(self, src, dst, algorithm="sha256"):
+        """Copies file bytes (no metadata) and returns the digest of what was written."""
+        h = hashlib.new(algorithm)
+        self._copy_chunks(src, dst, h.update)
+        return h.hexdigest()
+
+    def _copy_chunks(self, src, dst, on_chunk=None):
+        self.copy_backend.copy(src, dst, on_chunk)
 
     def stop(self):
         self.stop_event.set()
@@ -385,6 +3190,21 @@ class AndroidBackupEngine(BackupEngine):
         self.default_exceptions = [
             "/sdcard/Android/media/com.whatsapp/WhatsApp/Media"
         ]
+        # copy_files pulls up to this many files / bytes with one adb process;
+        # the argument length bound keeps the command line under Windows' limit
+        self.pull_batch_files = 64
+        self.pull_batch_bytes = 64 * 1024 * 1024
+        self.pull_batch_chars = 24000
+        # "pull": adb pull batches; "tar": one `adb exec-out tar` stream per
+        # device, extracted on the fly (see _copy_tar_stream)
+        self.transfer_mode = "pull"
+        # scan_files lists this many top-level /sdcard folders at once
+        self.scan_shells = 3
+        # Longest find command sent to `adb shell` (older adb/devices cut
+        # long commands); past it the extension filter stays in Python
+        self.find_command_limit = 4000
+        self.tar_list_dir = "/data/local/tmp"
+        self.tar_chunk_size = 1024 * 1024
 
     def _find_adb(self):
         # Check if adb is in path
@@ -423,12 +3243,12 @@ class AndroidBackupEngine(BackupEngine):
 
     def scan_files(self, device_id, category_extensions_map, custom_extensions, exclusions, exceptions=None, progress_callback=None):
         if not self.adb_exe:
-            return [], 0
+            return FileRecordList(), 0
             
         if exceptions is None:
             exceptions = []
 
-        files_to_copy = []
+        files_to_copy = FileRecordList()
         total_size = 0
         
         # Compile allowed extensions
@@ -444,107 +3264,9 @@ class AndroidBackupEngine(BackupEngine):
                 ext_to_cat[e] = "Altro"
         allowed_exts = {e.lower() for e in allowed_exts}
 
-        # Construct find command
         # We search in /sdcard/ (External Storage)
-        # Exclude common junk
-        
-        # Build exclude args for find
-        # find /sdcard -path "/sdcard/Android/data" -prune -o -path "/sdcard/Android/obb" -prune -o -type f -print
-        
         base_path = "/sdcard"
-        
-        # Basic exclusions to prune
-        prune_paths = [f"{base_path}/Android/data", f"{base_path}/Android/obb", f"{base_path}/.thumbnails"]
-        
-        # Helper to check if an exclusion is overridden by an exception (is parent of exception)
-        def is_parent_of_exception(excl_path):
-             excl_path = excl_path.replace("\\", "/")
-             for exc in exceptions:
-                 exc = exc.replace("\\", "/")
-                 # If exc starts with excl_path, then excl_path is a parent of exception
-                 # e.g. excl=/A, exc=/A/B
-                 if exc.startswith(excl_path) and len(exc) > len(excl_path):
-                     return True
-             return False
-
-        # Add user exclusions if they look like absolute paths or relative
-        for excl in exclusions:
-            # Clean up exclusion string
-            excl = excl.replace("\\", "/")
-            
-            path_to_prune = ""
-            if not excl.startswith("/"):
-                pass
-            else:
-                # Absolute path
-                if excl.startswith("/sdcard"):
-                    path_to_prune = excl
-                elif excl.startswith("/"):
-                     path_to_prune = f"{base_path}{excl}"
-            
-            if path_to_prune:
-                # Only prune if it DOES NOT contain an exception
-                if not is_parent_of_exception(path_to_prune):
-                    prune_paths.append(path_to_prune)
 
-        cmd_parts = [self.adb_exe, "-s", device_id, "shell", "find", base_path]
-        
-        # Add prunes
-        # Syntax: ( -path "path1" -o -path "path2" ) -prune -o -type f -print
-        # But adb shell escaping is tricky.
-        # Let's try a simpler approach: fetch all files and filter in Python?
-        # No, listing all files in Android/data is HUGE (thousands of cache files).
-        # We MUST prune Android/data.
-        
-        # "find /sdcard \( -path '/sdcard/Android/data' -o -path '/sdcard/Android/obb' \) -prune -o -type f -print"
-        
-        # Constructing the find command string safely
-        # Note: On Android, paths are case sensitive usually.
-        
-        find_cmd = f"find {base_path} \\( -path '{base_path}/Android/data' -o -path '{base_path}/Android/obb' -o -path '*/.thumbnails' -o -path '*/.cache' \\) -prune -o -type f -print"
-        
-        try:
-            # Run find
-            process = subprocess.Popen(
-                [self.adb_exe, "-s", device_id, "shell", find_cmd],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                encoding='utf-8',
-                errors='ignore'
-            )
-            
-            # Process output line by line
-            # Since we can't easily get size with standard find on all androids without -printf or stat loop,
-            # we will try to batch stat later OR just ignore size if it's too slow.
-            # But we need size for progress bar.
-            # Let's try to use `ls -l` for the found files? 
-            # No, too many files.
-            # Let's assume a dummy size first, or try to parse `ls -lR` instead of `find`.
-            
-            # Actually `ls -lR /sdcard` is robust enough usually.
-            # But parsing `ls -lR` is painful because of date formats.
-            
-            # Let's stick to `find` and then maybe do a batch `ls -l`?
-            # Or use `du -a`? `du -a /sdcard` gives size (blocks) and path.
-            # `du -k -a /sdcard` -> size in KB.
-            # `du` output: `1024   /sdcard/DCIM/Camera/IMG.jpg`
-            # This is good! Android `du` is usually available.
-            
-            pass
-        except Exception:
-            pass
-            
-        # Retrying with `du -a` approach which gives size and filtering
-        # But du includes directories.
-        # And we still want to prune Android/data before du scans it (it's slow).
-        # `du` doesn't support prune usually on Android toybox.
-        
-        # Back to `find`.
-        # Let's just use `find` to get paths. Then `ls -l` specific files? No.
-        # Let's try `stat -c '%s|%n'`.
-        # If stat is available (Android 6.0+), it's the best.
-        
         # 1. Get list of top-level folders in /sdcard to scan individually
         # This avoids "Permission denied" on one folder killing the whole find command
         folders_to_scan = []
@@ -569,99 +3291,180 @@ class AndroidBackupEngine(BackupEngine):
                 f"{base_path}/WhatsApp", f"{base_path}/Telegram"
             ]
 
-        # 2. Scan each folder individually
+        # Exclusions, exceptions and extensions are evaluated by find on the
+        # device, so excluded folders are never walked nor sent over adb.
+        # Sizes and mtimes come from `-exec stat -c '%s|%Y|%n'` (Android 6.0+),
+        # with a plain `-print` fallback (see _scan_remote_folder)
+        longest = max((len(_shell_quote(f)) for f in folders_to_scan), default=0)
+        find_filter = self._find_filter(exclusions, exceptions, allowed_exts,
+                                        reserved=len(self.FIND_COMMAND.format(folder="", filter="")) + longest)
+
+        # 2. Scan the folders on scan_shells adb shells at once; each shell
+        # streams its find/stat output and records are parsed as they arrive
+        folder_queue = Queue()
         for folder in folders_to_scan:
-            # Try with stat first for this folder
-            try:
-                # Construct stat command for this specific folder
-                # We still prune thumbnails/cache if found inside
-                stat_cmd = f"find '{folder}' \\( -path '*/.thumbnails' -o -path '*/.cache' -o -path '*/Android/data' \\) -prune -o -type f -exec stat -c '%s|%n' {{}} +"
-                
-                result = subprocess.run(
-                    [self.adb_exe, "-s", device_id, "shell", stat_cmd],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    encoding='utf-8',
-                    errors='ignore',
-                    check=False
-                )
-                
-                output = result.stdout
-                if not output and result.returncode != 0:
-                     # If stat failed, try simple find for this folder immediately
-                     raise Exception("Stat failed")
+            folder_queue.put(folder)
+        results = Queue()
 
-                for line in output.splitlines():
-                    if "|" not in line: continue
+        def worker():
+            try:
+                while not self.stop_event.is_set():
                     try:
-                        size_str, path = line.split("|", 1)
-                        size = int(size_str)
-                        path = path.strip()
-                        
-                        # Check for duplicates (files_to_copy is list of dicts, inefficient check but safe for small counts)
-                        # For speed, we trust path uniqueness from find
-                        
-                        ext = os.path.splitext(path)[1].lower()
-                        if ext in allowed_exts:
-                            if self._is_excluded_android(path, exclusions, exceptions): continue
-                            cat = ext_to_cat.get(ext, "Altro")
-                            
-                            # Simplify path if it matches an exception
-                            rel_path = self._simplify_exception_path(path, base_path, exceptions)
-                            
-                            files_to_copy.append({
-                                'source': path,
-                                'size': size,
-                                'category': cat,
-                                'rel_path': rel_path,
-                                'root_label': "Android",
-                                'device_id': device_id
-                            })
-                            total_size += size
-                            if progress_callback: progress_callback("scanning", os.path.basename(path))
-                    except ValueError:
-                        continue
-                        
-            except Exception:
-                # Fallback to simple find for this folder
-                try:
-                    find_cmd = f"find '{folder}' \\( -path '*/.thumbnails' -o -path '*/.cache' -o -path '*/Android/data' \\) -prune -o -type f -print"
-                    result = subprocess.run(
-                        [self.adb_exe, "-s", device_id, "shell", find_cmd],
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        text=True,
-                        encoding='utf-8',
-                        errors='ignore',
-                        check=False
-                    )
-                    for line in result.stdout.splitlines():
-                        path = line.strip()
-                        if not path: continue
-                        
-                        ext = os.path.splitext(path)[1].lower()
-                        if ext in allowed_exts:
-                            if self._is_excluded_android(path, exclusions, exceptions): continue
-                            cat = ext_to_cat.get(ext, "Altro")
-                            
-                            # Simplify path if it matches an exception
-                            rel_path = self._simplify_exception_path(path, base_path, exceptions)
-                            
-                            files_to_copy.append({
-                                'source': path,
-                                'size': 0,
-                                'category': cat,
-                                'rel_path': rel_path,
-                                'root_label': "Android",
-                                'device_id': device_id
-                            })
-                            if progress_callback: progress_callback("scanning", os.path.basename(path))
-                except Exception:
-                    pass
+                        folder = folder_queue.get_nowait()
+                    except Empty:
+                        return
+                    batch = []
+                    try:
+                        for entry in self._scan_remote_folder(device_id, folder, find_filter):
+                            batch.append(entry)
+                            if len(batch) >= 256:
+                                results.put(batch)
+                                batch = []
+                    except Exception:
+                        pass
+                    if batch:
+                        results.put(batch)
+            finally:
+                results.put(None)
+
+        threads = []
+        for _ in range(max(1, min(self.scan_shells, len(folders_to_scan)))):
+            t = threading.Thread(target=worker, daemon=True)
+            t.start()
+            threads.append(t)
+
+        finished = 0
+        while finished < len(threads):
+            batch = results.get()
+            if batch is None:
+                finished += 1
+                continue
+            for size, mtime_ns, path in batch:
+                ext = os.path.splitext(path)[1].lower()
+                if ext in allowed_exts:
+                    if self._is_excluded_android(path, exclusions, exceptions): continue
+                    cat = ext_to_cat.get(ext, "Altro")
+
+                    # Simplify path if it matches an exception
+                    rel_path = self._simplify_exception_path(path, base_path, exceptions)
+
+                    file_info = {
+                        'source': path,
+                        'size': size,
+                        'category': cat,
+                        'rel_path': rel_path,
+                        'root_label': "Android",
+                        'device_id': device_id
+                    }
+                    if mtime_ns is not None:
+                        file_info['mtime_ns'] = mtime_ns
+                    files_to_copy.append(file_info)
+                    total_size += size
+                    if progress_callback: progress_callback("scanning", os.path.basename(path))
 
         return files_to_copy, total_size
 
+    # Longest form of the scan command (see _scan_remote_folder)
+    FIND_COMMAND = "find {folder} {filter} -exec stat -c '%s|%Y|%n' {{}} +"
+
+    def _find_filter(self, exclusions, exceptions, allowed_exts, reserved=0):
+        """
+        find expression (everything before the action) that prunes excluded
+        paths and keeps only files with an allowed extension.
+        Same rules as _is_excluded_android: an exclusion matches anywhere in
+        the path, case-insensitively, but nothing starting with an exception
+        is pruned, nor the folders leading to one.
+        reserved: length of the rest of the command (find, folder, action).
+        Clauses that would make the whole command longer than
+        find_command_limit are left out, the extension clause first, then
+        the exclusions; scan_files filters again in Python either way.
+        """
+        # Thumbnail/cache folders are pruned even inside exceptions
+        expr = "\\( -path '*/.thumbnails' -o -path '*/.cache' -o -path '*/Android/data' \\) -prune -o "
+
+        prune = ""
+        patterns = []
+        for excl in exclusions:
+            e = excl.replace("\\", "/")
+            if e.strip("/"):
+                patterns.append("-ipath " + _shell_quote("*" + _find_escape(e) + "*"))
+        if patterns:
+            kept = []
+            for exc in exceptions or []:
+                e = exc.replace("\\", "/")
+                if not e.rstrip("/"):
+                    continue
+                # A prefix, like p.startswith(exc) in _is_excluded_android
+                kept.append("-ipath " + _shell_quote(_find_escape(e) + "*"))
+                parent = posixpath.dirname(e.rstrip("/"))
+                while parent not in ("", "/"):
+                    kept.append("-ipath " + _shell_quote(_find_escape(parent)))
+                    parent = posixpath.dirname(parent)
+            prune = "\\( " + " -o ".join(patterns) + " \\) "
+            if kept:
+                prune += "! \\( " + " -o ".join(kept) + " \\) "
+            prune += "-prune -o "
+        if reserved + len(expr) + len(prune) + len("-type f") <= self.find_command_limit:
+            expr += prune
+        expr += "-type f"
+
+        names = ["-iname " + _shell_quote("*" + _find_escape(ext)) for ext in sorted(allowed_exts) if ext.startswith(".")]
+        if names:
+            name_clause = " \\( " + " -o ".join(names) + " \\)"
+            if reserved + len(expr) + len(name_clause) <= self.find_command_limit:
+                expr += name_clause
+        return expr
+
+    def _scan_remote_folder(self, device_id, folder, find_filter):
+        """
+        Yields (size, mtime_ns, path) for the files under a device folder
+        that pass find_filter (see _find_filter), read line by line from
+        `find ... -exec stat` while the device is still walking. Falls back to
+        a plain `find -print` (size 0, mtime None) if stat is unavailable.
+        """
+        commands = [
+            (self.FIND_COMMAND.format(folder=_shell_quote(folder), filter=find_filter), True),
+            (f"find {_shell_quote(folder)} {find_filter} -print", False),
+        ]
+        for find_cmd, with_size in commands:
+            found = False
+            process = subprocess.Popen(
+                [self.adb_exe, "-s", device_id, "shell", find_cmd],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                text=True,
+                encoding='utf-8',
+                errors='ignore'
+            )
+            try:
+                for line in process.stdout:
+                    if self.stop_event.is_set():
+                        break
+                    if with_size:
+                        parts = line.split("|", 2)
+                        if len(parts) < 3: continue
+                        try:
+                            size = int(parts[0])
+                            mtime_ns = int(parts[1]) * 10**9
+                        except ValueError:
+                            continue
+                        path = parts[2]
+                    else:
+                        size, mtime_ns, path = 0, None, line
+                    path = path.strip()
+                    if not path: continue
+                    found = True
+                    yield size, mtime_ns, path
+            finally:
+                if process.poll() is None:
+                    process.kill()
+                process.stdout.close()
+                process.wait()
+
+            # Only an empty, failed stat run means stat is missing
+            if found or process.returncode == 0 or self.stop_event.is_set():
+                return
+
     def _simplify_exception_path(self, path, base_path, exceptions):
         """
         If path is inside an exception, we want to flatten it.
@@ -743,45 +3546,407 @@ class AndroidBackupEngine(BackupEngine):
                 
         return True
 
-    def copy_files(self, files_list, destination_root, verify=True, progress_callback=None):
-        copied_count = 0
-        copied_size = 0
-        errors = []
-        
+    def copy_files(self, files_list, destination_root, verify=True, progress_callback=None, workers=1, transfer=None, incremental=False):
+        """
+        Pulls files from the device with adb.
+        Files going to the same folder are pulled in batches (one
+        `adb pull src1 src2 ... folder` per pull_batch_files / pull_batch_bytes),
+        so a phone full of small pictures does not pay a process start and
+        adb handshake per file. Each file of a batch is still checked and
+        reported on its own.
+        workers: > 1 runs several pulls at once (see CopyPool, limited per device).
+        transfer: "pull" or "tar" (default: self.transfer_mode). With "tar"
+        the whole set comes as a single tar stream; files the stream did not
+        deliver are pulled afterwards, which also reports why they failed.
+        incremental: files whose size and device mtime match the newest
+        previous Android_Backup_* of the same device are hardlinked to it (or
+        only referenced in the manifest, see SnapshotManifest) instead of
+        pulled.
+        Every run writes its manifest, keyed by the path inside the snapshot,
+        with the ids of the devices it holds in its info line.
+        """
+        transfer = transfer or self.transfer_mode
         if not self.adb_exe:
             return 0, ["ADB not found"]
 
         dest_path = Path(destination_root) / f"Android_Backup_{int(time.time())}"
         dest_path.mkdir(parents=True, exist_ok=True)
-        
+        folders = DirectoryCreator(dest_path)
+        self.copy_stats = {'copied': 0, 'linked': 0, 'referenced': 0, 'warnings': []}
+        previous_for = None
+        if incremental:
+            previous_for = self._previous_for_device(destination_root, dest_path.name)
+        device_ids = sorted({f.get('device_id') for f in files_list if f.get('device_id')})
+        manifest = SnapshotManifest(dest_path, {'device_ids': device_ids})
+        try:
+            reused, reused_size, to_pull = self._link_unchanged(files_list, previous_for, manifest, dest_path, folders)
+            copied, errors = self._pull_files(to_pull, dest_path, folders, manifest, progress_callback,
+                                              workers, transfer, reused_size)
+        finally:
+            manifest.close()
+        self.copy_stats['copied'] = copied
+        return reused + copied, errors
+
+    @staticmethod
+    def _manifest_key(file_info):
+        """Path of a pulled file inside its Android_Backup_* folder, with '/' separators."""
+        return file_info['rel_path'].replace("\\", "/").strip("/")
+
+    @staticmethod
+    def _previous_for_device(destination_root, current_name=None):
+        """
+        previous_for(device_id) -> PreviousSnapshot: the newest Android_Backup_*
+        that holds that device (manifest info), or None; looked up once per device.
+        """
+        found = {}
+
+        def previous_for(device_id):
+            if device_id not in found:
+                found[device_id] = SnapshotManifest.previous_snapshot(
+                    destination_root, "Android_Backup_", current_name,
+                    lambda info: device_id in info.get('device_ids', ()))
+            return found[device_id]
+        return previous_for
+
+    def _unchanged_predicate(self, destination_root, incremental=False, dedup=False):
+        """plan_backup: files an incremental run would link instead of pull."""
+        if not incremental:
+            return None
+        previous_for = self._previous_for_device(destination_root)
+
+        def unchanged(file_info):
+            previous = previous_for(file_info.get('device_id'))
+            if previous is None or file_info.get('mtime_ns') is None:
+                return False
+            key = self._manifest_key(file_info)
+            return previous.unchanged_location(key, file_info['size'], file_info['mtime_ns']) is not None
+        return unchanged
+
+    def _link_unchanged(self, files_list, previous_for, manifest, dest_path, folders):
+        """
+        Links (or references) the files unchanged since the previous snapshot
+        of their device (previous_for, see _previous_for_device).
+        Returns (reused_count, reused_bytes, records still to pull).
+        """
+        if previous_for is None:
+            return 0, 0, files_list
+        reused = 0
+        reused_size = 0
+        to_pull = FileRecordList() if isinstance(files_list, FileRecordList) else []
         for file_info in files_list:
-             # Check Stop
             if self.stop_event.is_set():
                 break
-                
+            mtime_ns = file_info.get('mtime_ns')
+            # Fallback scans have no mtime: those files are always pulled
+            if mtime_ns is not None:
+                key = self._manifest_key(file_info)
+                dst = dest_path / file_info['rel_path']
+                previous = previous_for(file_info.get('device_id'))
+                found = None
+                if previous is not None:
+                    folders.ensure(dst.parent)
+                    found = self._reuse_previous(previous, key, file_info['size'], mtime_ns, dst)
+                if found is not None:
+                    outcome, codec = found
+                    manifest.add(key, file_info['size'], mtime_ns, outcome, codec)
+                    self.copy_stats['linked' if outcome == "" else 'referenced'] += 1
+                    reused += 1
+                    reused_size += file_info['size']
+                    continue
+            to_pull.append(file_info)
+        return reused, reused_size, to_pull
+
+    def _pull_files(self, files_list, dest_path, folders, manifest, progress_callback, workers, transfer, offset=0):
+        """
+        Transfers files_list into dest_path and records each file in the
+        manifest. offset: bytes already accounted for in the progress.
+        Returns (copied_count, errors).
+        """
+        def pull(device_id, sources, target):
+            """(returncode, stderr lines) of one `adb pull`."""
+            try:
+                result = subprocess.run([self.adb_exe, "-s", device_id, "pull"] + sources + [str(target)],
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                        text=True, encoding='utf-8', errors='ignore', check=False)
+            except Exception as e:
+                return None, [str(e)]
+            return result.returncode, result.stderr.splitlines()
+
+        def pulled_size(file_info, dst):
+            """Size of a complete copy at dst, else None."""
+            try:
+                size = os.path.getsize(dst)
+            except OSError:
+                return None
+            # Fallback scans record size 0 (unknown): presence is enough then
+            if file_info['size'] and size != file_info['size']:
+                return None
+            return size
+
+        def failure(src, dst, returncode, stderr_lines):
+            reason = next((line.strip() for line in stderr_lines if src in line), None)
+            if reason is None:
+                if returncode is None:
+                    reason = stderr_lines[0]
+                elif os.path.exists(dst):
+                    reason = "incomplete copy"
+                else:
+                    reason = f"adb pull failed ({returncode})"
+            return f"Error pulling {src}: {reason}"
+
+        def copy_one(batch):
+            dst_dir = batch['dst_dir']
+            sources = [f['source'] for f in batch['files']]
+            try:
+                folders.ensure(dst_dir)
+            except OSError as e:
+                return False, [f"Error pulling {src}: {e}" for src in sources]
+            # Saved under another name than on the device: single pull to the full path
+            returncode, stderr_lines = pull(batch['device_id'], sources, batch['target'] or dst_dir)
+
+            copied = 0
+            copied_size = 0
+            errors = []
+            for file_info in batch['files']:
+                src = file_info['source']
+                dst = batch['target'] or dst_dir / posixpath.basename(src)
+                size = pulled_size(file_info, dst)
+                if size is None and len(sources) > 1 and returncode != 0 and not self.stop_event.is_set():
+                    # adb gives up on the rest of a batch after one failure:
+                    # what is missing is pulled again on its own
+                    single_code, single_lines = pull(batch['device_id'], [src], dst)
+                    size = pulled_size(file_info, dst)
+                    if size is None:
+                        errors.append(failure(src, dst, single_code, single_lines))
+                        continue
+                elif size is None:
+                    errors.append(failure(src, dst, returncode, stderr_lines))
+                    continue
+                manifest.add(self._manifest_key(file_info), size, file_info.get('mtime_ns'))
+                copied += 1
+                copied_size += size
+            return (copied, copied_size), errors
+
+        def shifted(offset):
+            if not progress_callback or not offset:
+                return progress_callback
+
+            def callback(action, filename, current_copied_size=0):
+                progress_callback(action, filename, offset + current_copied_size)
+            return callback
+
+        if transfer != "tar":
+            return self._run_copy(self._pull_batches(files_list, dest_path), copy_one, shifted(offset), workers)
+
+        copied, errors, remaining, streamed = self._copy_tar_stream(files_list, dest_path, folders, shifted(offset), manifest)
+        if not remaining or self.stop_event.is_set():
+            return copied, errors
+
+        count, pull_errors = self._run_copy(self._pull_batches(remaining, dest_path), copy_one,
+                                            shifted(offset + streamed), workers)
+        return copied + count, errors + pull_errors
+
+    # Local write errors that fail every later file too: the stream is abandoned
+    DESTINATION_FULL_ERRNOS = (errno.ENOSPC, getattr(errno, 'EDQUOT', errno.ENOSPC), errno.EROFS, errno.EIO)
+
+    def _copy_tar_stream(self, files_list, dest_path, folders, progress_callback=None, manifest=None):
+        """
+        Streams files_list from each device as one tar archive
+        (`adb exec-out tar -cf - -T <list>`, the list pushed to tar_list_dir)
+        and extracts it on the fly into the same layout as the pull transfer.
+        Progress is reported in bytes while the stream comes in; extracted
+        files are recorded in manifest when given.
+        A file that cannot be written is reported and the stream goes on,
+        unless the destination is full or read-only: then the remaining files
+        are reported with the same cause. A broken stream is not an error by
+        itself (its files are pulled afterwards): it goes to
+        copy_stats['warnings'].
+        Returns (copied_count, errors, remaining, streamed_bytes): remaining
+        are the records the stream did not deliver (unreadable on the device,
+        broken stream, names tar cannot take from a list), to be pulled.
+        """
+        copied = 0
+        errors = []
+        remaining = []
+        streamed = 0
+        fatal = None
+        by_device = {}
+        for file_info in files_list:
+            src = file_info['source']
+            if "\n" in src:
+                remaining.append(file_info)
+                continue
+            # tar stores "/sdcard/x" as "sdcard/x"
+            pending = by_device.setdefault(file_info.get('device_id'), {})
+            pending.setdefault(src.lstrip("/"), []).append(file_info)
+
+        for device_id, pending in by_device.items():
+            if self.stop_event.is_set():
+                break
+            if fatal is not None:
+                for infos in pending.values():
+                    remaining.extend(infos)
+                continue
+
+            remote_list = f"{self.tar_list_dir}/autobackup_{os.getpid()}_{int(time.time())}.list"
+            fd, local_list = tempfile.mkstemp(suffix=".list")
+            proc = None
+            part = None
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8", newline="\n") as f:
+                    for infos in pending.values():
+                        f.write(infos[0]['source'] + "\n")
+                subprocess.run([self.adb_exe, "-s", device_id, "push", local_list, remote_list],
+                               check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                proc = subprocess.Popen(
+                    [self.adb_exe, "-s", device_id, "exec-out", f"tar -cf - -T {remote_list} 2>/dev/null"],
+                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+                )
+
+                with tarfile.open(fileobj=proc.stdout, mode="r|") as tar:
+                    for member in tar:
+                        self.pause_event.wait()
+                        if self.stop_event.is_set():
+                            break
+                        if not member.isfile():
+                            continue
+                        name = member.name[2:] if member.name.startswith("./") else member.name
+                        infos = pending.pop(name.lstrip("/"), None)
+                        if infos is None:
+                            continue
+
+                        file_info = infos[0]
+                        dst = dest_path / file_info['rel_path']
+                        part = dst.with_name(dst.name + ".autobackup.part")
+                        reader = tar.extractfile(member)
+                        # Errors reading reader belong to the stream (outer except);
+                        # errors writing the destination are caught right here
+                        write_error = None
+                        try:
+                            folders.ensure(dst.parent)
+                            out = open(part, "wb")
+                        except OSError as e:
+                            write_error = e
+                        else:
+                            with out:
+                                while True:
+                                    chunk = reader.read(self.tar_chunk_size)
+                                    if not chunk:
+                                        break
+                                    try:
+                                        out.write(chunk)
+                                    except OSError as e:
+                                        write_error = e
+                                        break
+                                    streamed += len(chunk)
+                                    if progress_callback:
+                                        progress_callback("copying", os.path.basename(file_info['source']), streamed)
+                        if write_error is None:
+                            try:
+                                os.replace(part, dst)
+                                part = None
+                                # Same device file saved under several names (exceptions)
+                                for other in infos[1:]:
+                                    other_dst = dest_path / other['rel_path']
+                                    folders.ensure(other_dst.parent)
+                                    shutil.copyfile(dst, other_dst)
+                            except OSError as e:
+                                write_error = e
+
+                        if write_error is not None:
+                            try:
+                                os.remove(part)
+                            except OSError:
+                                pass
+                            part = None
+                            for failed in infos:
+                                errors.append(f"Error copying {failed['source']}: {str(write_error)}")
+                            if write_error.errno in self.DESTINATION_FULL_ERRNOS:
+                                fatal = write_error
+                                break
+                            continue
+
+                        for done in infos:
+                            if manifest is not None:
+                                manifest.add(self._manifest_key(done), member.size, done.get('mtime_ns'))
+                            copied += 1
+
+                # An archive cut short can still look complete to tarfile
+                if pending and fatal is None and not self.stop_event.is_set():
+                    returncode = proc.wait()
+                    if returncode != 0:
+                        raise subprocess.CalledProcessError(returncode, "tar")
+            except (tarfile.TarError, EOFError, OSError, subprocess.CalledProcessError) as e:
+                # No tar on the device or a broken stream: whatever is still
+                # pending is pulled afterwards, and reported only if that fails
+                self.copy_stats['warnings'].append(f"Error streaming from {device_id}: {str(e)} (remaining files pulled one by one)")
+            finally:
+                if part is not None:
+                    try:
+                        os.remove(part)
+                    except OSError:
+                        pass
+                if proc is not None:
+                    if proc.poll() is None:
+                        proc.kill()
+                    proc.stdout.close()
+                    proc.wait()
+                    subprocess.run([self.adb_exe, "-s", device_id, "shell", "rm", "-f", remote_list],
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+                os.remove(local_list)
+
+            for infos in pending.values():
+                remaining.extend(infos)
+
+        if fatal is not None:
+            # Pulling the rest would fail the same way
+            for file_info in remaining:
+                errors.append(f"Error copying {file_info['source']}: {str(fatal)}")
+            remaining = []
+        return copied, errors, remaining, streamed
+
+    def _pull_batches(self, files_list, dest_path):
+        """
+        Groups file records into pull batches: same device and destination
+        folder, bounded by pull_batch_files / pull_batch_bytes / pull_batch_chars.
+        A batch looks like a file record to _run_copy (source, size,
+        device_id, root_label) and carries its files, dst_dir and target (the
+        full destination path when a single file is saved under another name).
+        """
+        open_batches = {}
+
+        def new_batch(file_info, dst_dir, target=None):
+            return {
+                'source': file_info['source'], 'size': 0, 'device_id': file_info.get('device_id'),
+                'root_label': file_info.get('root_label', ""), 'files': [], 'dst_dir': dst_dir,
+                'target': target, 'chars': 0,
+            }
+
+        for file_info in files_list:
             src = file_info['source']
-            device_id = file_info.get('device_id')
-            rel = file_info['rel_path']
-            cat = file_info['category']
-            
             # On Android, user requested to keep original structure instead of categories
             # rel is already relative to /sdcard (e.g. DCIM/Camera/img.jpg)
-            dst = dest_path / rel
-            
-            try:
-                dst.parent.mkdir(parents=True, exist_ok=True)
-                
-                if progress_callback:
-                    progress_callback("copying", os.path.basename(src), copied_size)
-                
-                # adb pull
-                cmd = [self.adb_exe, "-s", device_id, "pull", src, str(dst)]
-                subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                
-                copied_count += 1
-                copied_size += file_info['size']
-                
-            except Exception as e:
-                errors.append(f"Error pulling {src}: {e}")
-                
-        return copied_count, errors
+            dst = dest_path / file_info['rel_path']
+            if dst.name != posixpath.basename(src):
+                batch = new_batch(file_info, dst.parent, dst)
+                batch['files'].append(file_info)
+                batch['size'] = file_info['size']
+                yield batch
+                continue
+
+            key = (file_info.get('device_id'), dst.parent)
+            batch = open_batches.get(key)
+            if batch is not None and (len(batch['files']) >= self.pull_batch_files
+                                      or batch['size'] + file_info['size'] > self.pull_batch_bytes
+                                      or batch['chars'] + len(src) > self.pull_batch_chars):
+                yield open_batches.pop(key)
+                batch = None
+            if batch is None:
+                batch = new_batch(file_info, dst.parent)
+                open_batches[key] = batch
+            batch['files'].append(file_info)
+            batch['size'] += file_info['size']
+            batch['chars'] += len(src) + 3
+
+        for batch in open_batches.values():
+            yield batch
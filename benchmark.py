@@ -0,0 +1,331 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+from pathlib import Path
+
+from backup_engine import BackupEngine, DirectoryCreator
+
+# Folder names the generated trees use for system / excluded folders
+SYSTEM_FOLDER_NAMES = ["AppData", "Temp", "Library", "node_modules"]
+# Extensions the engine does not select, so scans also skip files
+OTHER_EXTENSIONS = [".tmp", ".log", ".dat", ".ini"]
+
+SIZE_PROFILES = ("small", "mixed", "large")
+
+
+def _file_size(rng, profile):
+    if profile == "small":
+        return rng.randint(0, 16 * 1024)
+    if profile == "large":
+        return rng.randint(1024 * 1024, 32 * 1024 * 1024)
+    # mixed: mostly small documents and photos, a long tail of big files
+    return min(int(rng.lognormvariate(9, 2.2)), 256 * 1024 * 1024)
+
+
+def generate_tree(root, depth=3, fanout=4, files_per_dir=20, size_profile="mixed",
+                  hidden_ratio=0.1, system_ratio=0.05, selected_ratio=0.8, seed=1):
+    """
+    Writes a synthetic source tree under root (same seed = same tree).
+    Every folder gets files_per_dir files (selected_ratio of them with an
+    extension the engine backs up) and, down to depth, fanout subfolders;
+    hidden_ratio of those are dot-folders and system_ratio carry a system
+    folder name. root/AppData/Keep always exists, as the exception folder.
+    Returns {'files', 'bytes', 'dirs'} of what was written.
+    """
+    rng = random.Random(seed)
+    engine_exts = [ext for exts in BackupEngine().categories.values() for ext in exts]
+    # One random block, repeated: contents do not need to be unique
+    block = rng.randbytes(64 * 1024) if hasattr(rng, "randbytes") else os.urandom(64 * 1024)
+    stats = {'files': 0, 'bytes': 0, 'dirs': 0}
+
+    def write_files(folder):
+        for i in range(files_per_dir):
+            ext = rng.choice(engine_exts) if rng.random() < selected_ratio else rng.choice(OTHER_EXTENSIONS)
+            size = _file_size(rng, size_profile)
+            with open(os.path.join(folder, f"file_{i}{ext}"), "wb") as f:
+                remaining = size
+                while remaining > 0:
+                    chunk = block[:remaining]
+                    f.write(chunk)
+                    remaining -= len(chunk)
+            stats['files'] += 1
+            stats['bytes'] += size
+
+    def build(folder, level):
+        os.makedirs(folder, exist_ok=True)
+        stats['dirs'] += 1
+        write_files(folder)
+        if level >= depth:
+            return
+        for i in range(fanout):
+            roll = rng.random()
+            if roll < hidden_ratio:
+                name = f".hidden_{i}"
+            elif roll < hidden_ratio + system_ratio:
+                name = rng.choice(SYSTEM_FOLDER_NAMES)
+            else:
+                name = f"dir_{level}_{i}"
+            build(os.path.join(folder, name), level + 1)
+
+    build(str(root), 0)
+    build(os.path.join(str(root), "AppData", "Keep"), depth)
+    return stats
+
+
+def _io_counters():
+    """Read/write syscall counters of this process (Linux /proc), else None."""
+    try:
+        with open("/proc/self/io") as f:
+            values = dict(line.split(":", 1) for line in f.read().splitlines())
+        return {'read': int(values['syscr']), 'write': int(values['syscw'])}
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _peak_rss_kb():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, KB elsewhere
+        return peak // 1024 if sys.platform == "darwin" else peak
+    except ImportError:
+        try:
+            import psutil
+            return getattr(psutil.Process().memory_info(), 'peak_wset', 0) // 1024
+        except Exception:
+            return None
+
+
+def measure(name, func, trace_memory=False):
+    """
+    Runs func() -> (files, bytes) and returns the phase result: seconds,
+    files/s, MB/s, read/write syscalls, process peak RSS and, with
+    trace_memory, the Python heap peak of the phase.
+    """
+    io_before = _io_counters()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    files, nbytes = func()
+    elapsed = time.perf_counter() - start
+    python_peak = None
+    if trace_memory:
+        python_peak = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+    io_after = _io_counters()
+
+    result = {
+        'seconds': round(elapsed, 4),
+        'files': files,
+        'bytes': nbytes,
+        'files_per_s': round(files / elapsed, 1) if elapsed else None,
+        'mb_per_s': round(nbytes / (1024 * 1024) / elapsed, 2) if elapsed else None,
+        'syscalls': {k: io_after[k] - io_before[k] for k in io_after} if io_before and io_after else None,
+        'peak_rss_kb': _peak_rss_kb(),
+    }
+    if trace_memory:
+        result['python_peak_kb'] = python_peak
+    print(f"  {name:22s} {elapsed:8.3f} s  {result['files_per_s'] or 0:12.0f} file/s  {result['mb_per_s'] or 0:9.2f} MB/s")
+    return result
+
+
+def synthetic_records(file_count, files_per_dir=100, depth=3):
+    """
+    File records shaped like BackupEngine.scan_files output, spread over
+    nested folders (no files are created: only the destination tree matters here).
+    """
+    categories = ["Documenti", "Immagini", "Video", "Audio", "Archivi"]
+    records = []
+    for i in range(file_count):
+        folder = i // files_per_dir
+        parts = [f"d{(folder // (10 ** level)) % 10}" for level in range(depth, 0, -1)] + [f"f{folder}"]
+        records.append({
+            'source': "",
+            'rel_path': os.path.join(*parts, f"file_{i}.dat"),
+            'root_label': "C",
+            'category': categories[folder % len(categories)],
+            'size': 0,
+        })
+    return records
+
+
+def target_dirs(records, dest_path):
+    return [dest_path / r['category'] / r['root_label'] / Path(r['rel_path']).parent for r in records]
+
+
+def bench_mkdir_per_file(records, dest_path):
+    """The old copy loop: mkdir(parents=True, exist_ok=True) before every file."""
+    for folder in target_dirs(records, dest_path):
+        folder.mkdir(parents=True, exist_ok=True)
+    return len(records), 0
+
+
+def bench_mkdir_batched(records, dest_path):
+    """DirectoryCreator: unique folder set created once, then set lookups per file."""
+    folders = DirectoryCreator(dest_path)
+    dirs = target_dirs(records, dest_path)
+    folders.prepare(dirs)
+    for folder in dirs:
+        folders.ensure(folder)
+    return len(records), 0
+
+
+def _fresh_dir(path):
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    return path
+
+
+def run_suite(work_dir, args):
+    """Generates the tree under work_dir and runs the selected phases. Returns the results dict."""
+    source = os.path.join(work_dir, "source")
+    destination = os.path.join(work_dir, "destination")
+    phases = set(args.phases.split(","))
+
+    engine = BackupEngine()
+    # Keep catalogs and caches inside the benchmark folder
+    engine.data_dir = os.path.join(work_dir, "state")
+    engine.scan_catalog_path = os.path.join(engine.data_dir, "scan_catalog.sqlite")
+    engine.hash_cache_path = os.path.join(engine.data_dir, "hash_cache.sqlite")
+
+    print(f"Generazione albero sintetico in {source}...")
+    if os.path.exists(source):
+        shutil.rmtree(source)
+    tree = generate_tree(source, args.depth, args.fanout, args.files_per_dir, args.size_profile,
+                         args.hidden_ratio, args.system_ratio, seed=args.seed)
+    print(f"  {tree['files']} file, {tree['dirs']} cartelle, {tree['bytes'] / (1024 * 1024):.1f} MB")
+
+    exclusions = engine.system_folders + SYSTEM_FOLDER_NAMES
+    exceptions = [os.path.join(source, "AppData", "Keep")]
+    results = {}
+    scanned = {}
+
+    def scan(**options):
+        files, size = engine.scan_files([source], engine.categories, [], exclusions, exceptions, **options)
+        scanned['files'] = files
+        return len(files), size
+
+    print("Fasi:")
+    # Always scanned: the other phases work on its file list
+    results['scan'] = measure("scan", scan, args.memory)
+    if "scan" in phases:
+        results['scan_parallel'] = measure("scan_parallel", lambda: scan(parallel=True), args.memory)
+        results['scan_incremental_cold'] = measure("scan_incremental_cold", lambda: scan(incremental=True), args.memory)
+        results['scan_incremental_warm'] = measure("scan_incremental_warm", lambda: scan(incremental=True), args.memory)
+
+    files = scanned['files']
+    total_bytes = files.total_size
+
+    if "exclude" in phases:
+        folders = [root for root, _, _ in os.walk(source)]
+
+        def check_exclusions():
+            for folder in folders:
+                engine._is_excluded(folder, exclusions, exceptions)
+            return len(folders), 0
+
+        results['exclude'] = measure("exclude", check_exclusions, args.memory)
+
+    if "copy" in phases or "verify" in phases:
+        def copy(workers):
+            _fresh_dir(destination)
+            engine.copy_files(files, destination, verify=False, workers=workers)
+            return len(files), total_bytes
+
+        results['copy'] = measure("copy", lambda: copy(1), args.memory)
+        if "copy" in phases:
+            results['copy_parallel'] = measure("copy_parallel", lambda: copy(engine.copy_workers), args.memory)
+            results['copy_stats'] = {k: v for k, v in engine.copy_stats.items() if k != 'io'}
+
+    if "verify" in phases:
+        snapshot = os.path.join(destination, os.listdir(destination)[0])
+        pairs = []
+        for f in files:
+            dst = Path(snapshot) / f['category'] / f['root_label'] / f['rel_path']
+            pairs.append((Path(f['source']), dst))
+
+        def verify():
+            if os.path.exists(engine.hash_cache_path):
+                os.remove(engine.hash_cache_path)
+            for src, dst in pairs:
+                engine._verify_file(src, dst)
+            engine._close_hash_cache()
+            return len(pairs), total_bytes
+
+        results['verify'] = measure("verify", verify, args.memory)
+
+    if "mkdir" in phases:
+        records = synthetic_records(args.mkdir_files)
+        for name, func in (("mkdir_per_file", bench_mkdir_per_file), ("mkdir_batched", bench_mkdir_batched)):
+            dest_path = Path(_fresh_dir(os.path.join(work_dir, name)))
+            results[name] = measure(name, lambda: func(records, dest_path), args.memory)
+            shutil.rmtree(dest_path)
+
+    return {'tree': tree, 'phases': results}
+
+
+def _commit():
+    try:
+        res = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=False)
+        return res.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark delle fasi del motore di backup su un albero sintetico")
+    parser.add_argument("--dir", default=None, help="Cartella in cui creare la cartella di lavoro (es. la chiavetta USB); default: temporanea")
+    parser.add_argument("--depth", type=int, default=3, help="Profondità dell'albero")
+    parser.add_argument("--fanout", type=int, default=4, help="Sottocartelle per cartella")
+    parser.add_argument("--files-per-dir", type=int, default=20)
+    parser.add_argument("--size-profile", choices=SIZE_PROFILES, default="mixed")
+    parser.add_argument("--hidden-ratio", type=float, default=0.1, help="Quota di cartelle nascoste")
+    parser.add_argument("--system-ratio", type=float, default=0.05, help="Quota di cartelle di sistema (escluse)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--phases", default="scan,exclude,copy,verify,mkdir",
+                        help="Fasi separate da virgola: scan, exclude, copy, verify, mkdir")
+    parser.add_argument("--mkdir-files", type=int, default=100000, help="File simulati per la fase mkdir")
+    parser.add_argument("--memory", action="store_true", help="Misura anche il picco di memoria Python (più lento)")
+    parser.add_argument("--output", default=None, help="File JSON dei risultati (default: stampa a video)")
+    parser.add_argument("--keep", action="store_true", help="Non cancellare la cartella di lavoro creata dal benchmark")
+    args = parser.parse_args()
+
+    # Always a fresh subfolder: --dir may be a stick that already holds backups
+    if args.dir:
+        os.makedirs(args.dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="autobackup_bench_", dir=args.dir)
+    try:
+        suite = run_suite(work_dir, args)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'commit': _commit(),
+        'timestamp': int(time.time()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'keep')},
+        **suite,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"Risultati salvati in {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,7 +4,7 @@ import subprocess
 import psutil
 import time
 import shutil
-from backup_engine import BackupEngine, AndroidBackupEngine
+from backup_engine import BackupEngine, AndroidBackupEngine, ObjectStore, PackWriter, SnapshotManifest
 from colorama import init, Fore, Style
 from tqdm import tqdm
 
@@ -27,6 +27,16 @@ class GumBackupApp:
         self.active_category_map = {}
         self.extra_folders = []
         self.whitelist_paths = [os.path.expanduser("~")] # Default to user home
+        self.stream_mode = False
+        self.incremental_backup = False
+        self.dest_format = "folders"
+        self.verify_mode = "full"
+        self.deferred_verify = None
+        self.compress_mode = None
+        self.resume_backup = False
+        self.android_transfer = "pull"
+        self.scan_cache = False
+        self.scan_roots = []
 
     def _find_gum(self):
         if hasattr(sys, '_MEIPASS'):
@@ -85,12 +95,14 @@ class GumBackupApp:
 
     def step_select_mode(self):
         self.print_header("Seleziona Modalità")
-        res = self._run_gum(["choose", "--header", "Che tipo di backup vuoi effettuare?", "Backup di PC/Mac", "Backup di Android"])
+        res = self._run_gum(["choose", "--header", "Che tipo di backup vuoi effettuare?", "Backup di PC/Mac", "Backup di Android", "Ripristina un backup"])
         
         if res.returncode != 0:
             sys.exit()
             
-        if "Android" in res.stdout:
+        if "Ripristina" in res.stdout:
+            self.mode = "Restore"
+        elif "Android" in res.stdout:
             self.mode = "Android"
             self.whitelist_paths = [] # Clear default whitelist for Android
             self.android_engine = AndroidBackupEngine()
@@ -533,29 +545,98 @@ class GumBackupApp:
             print(Fore.RED + "Operazione annullata dall'utente.")
             sys.exit()
 
+        if self.mode == "PC":
+            formats = {
+                "Cartelle (standard)": "folders",
+                "Cartelle, file piccoli raggruppati in archivi .tar (più veloce su chiavette FAT/exFAT)": "packed",
+                "Archivio deduplicato (ogni contenuto salvato una sola volta)": "dedup",
+            }
+            res = self._run_gum(["choose", "--header", "Formato della destinazione"] + list(formats.keys()))
+            if res.returncode != 0:
+                sys.exit()
+            self.dest_format = formats.get(res.stdout.strip(), "folders")
+
+            verify_modes = {
+                "Completa (hash durante la copia + rilettura)": ("full", None),
+                "A campione (blocchi iniziali, finali e casuali)": ("sampled", None),
+                "Solo dimensione e data": ("size", None),
+                "Completa, differita a fine copia": ("full", "after"),
+            }
+            if self.dest_format == "dedup":
+                # The store checks each content before keeping it
+                del verify_modes["Completa, differita a fine copia"]
+            res = self._run_gum(["choose", "--header", "Verifica dei file copiati"] + list(verify_modes.keys()))
+            if res.returncode != 0:
+                sys.exit()
+            self.verify_mode, self.deferred_verify = verify_modes.get(res.stdout.strip(), ("full", None))
+
+            if self.dest_format != "dedup":
+                compress_modes = {
+                    "Nessuna": None,
+                    "Solo Documenti (.gz)": "category",
+                    "Automatica (file comprimibili, .gz)": "auto",
+                }
+                res = self._run_gum(["choose", "--header", "Compressione"] + list(compress_modes.keys()))
+                if res.returncode != 0:
+                    sys.exit()
+                self.compress_mode = compress_modes.get(res.stdout.strip())
+
+            dest_mount = self.selected_drive['mountpoint']
+            unfinished = self.engine.find_unfinished_backup(dest_mount) if self.dest_format != "dedup" else None
+            if unfinished:
+                res = self._run_gum(["confirm", f"Backup interrotto trovato ({unfinished}). Vuoi riprenderlo (copia solo i file mancanti)?"])
+                self.resume_backup = res.returncode == 0
+
+            has_previous = any(n.startswith("Backup_") for n in os.listdir(dest_mount)) if os.path.isdir(dest_mount) else False
+            # The deduplicated store is always incremental
+            if has_previous and self.dest_format in ("folders", "packed"):
+                res = self._run_gum(["confirm", "Backup precedente trovato. Vuoi un backup incrementale (copia solo i file nuovi o modificati)?"])
+                self.incremental_backup = res.returncode == 0
+
+            # Cached folders still stat their files, so on local disks the
+            # catalog saves little: off unless asked for
+            res = self._run_gum(["confirm", "--default=false", "Vuoi riutilizzare l'elenco delle cartelle non modificate dalla scansione precedente (utile solo su dischi lenti o di rete)?"])
+            self.scan_cache = res.returncode == 0
+
+            res = self._run_gum(["confirm", "--default=false", "Vuoi avviare la copia durante la scansione (modalità streaming)?"])
+            if res.returncode == 0:
+                # Scan and copy run together in step4_perform_streaming_backup
+                self.stream_mode = True
+                self.scan_roots = all_scan_roots
+                return None, 0
+        else:
+            transfers = {
+                "File per file (adb pull)": "pull",
+                "Flusso unico (tar, più veloce con molte foto)": "tar",
+            }
+            res = self._run_gum(["choose", "--header", "Modalità di trasferimento"] + list(transfers.keys()))
+            if res.returncode != 0:
+                sys.exit()
+            self.android_transfer = transfers.get(res.stdout.strip(), "pull")
+
+            dest_mount = self.selected_drive['mountpoint']
+            has_previous = any(n.startswith("Android_Backup_") for n in os.listdir(dest_mount)) if os.path.isdir(dest_mount) else False
+            if has_previous:
+                res = self._run_gum(["confirm", "Backup Android precedente trovato. Vuoi un backup incrementale (scarica solo i file nuovi o modificati)?"])
+                self.incremental_backup = res.returncode == 0
+
         print(Fore.YELLOW + "Avvio analisi file in corso...")
         
         if self.mode == "PC":
-            files, size = self.engine.scan_files(all_scan_roots, cat_map, self.custom_extensions, self.exclusions, self.exceptions)
+            files, size = self.engine.scan_files(all_scan_roots, cat_map, self.custom_extensions, self.exclusions, self.exceptions, parallel=True, incremental=self.scan_cache)
         else:
-            files, size = self.android_engine.scan_files(self.android_device_id, cat_map, self.custom_extensions, self.exclusions, self.exceptions)
+            # The device streams its listing, so files are counted as they arrive
+            scan_bar = tqdm(unit=" file", desc="Scansione")
+            files, size = self.android_engine.scan_files(
+                self.android_device_id, cat_map, self.custom_extensions, self.exclusions, self.exceptions,
+                progress_callback=lambda action, filename: scan_bar.update(1)
+            )
+            scan_bar.close()
         
         if self.test_mode:
             print(Fore.YELLOW + "Applicazione filtro TEST MODE (max 10 file per categoria)...")
-            filtered_files = []
-            cat_counts = {}
-            new_size = 0
-            
-            for f in files:
-                cat = f['category']
-                count = cat_counts.get(cat, 0)
-                if count < 10:
-                    filtered_files.append(f)
-                    cat_counts[cat] = count + 1
-                    new_size += f['size']
-            
-            files = filtered_files
-            size = new_size
+            files = files.limit_per_category(10)
+            size = files.total_size
 
         self.print_header("Riepilogo")
         if self.test_mode:
@@ -569,12 +650,53 @@ class GumBackupApp:
             print(Fore.RED + "\nNessun file trovato.")
             sys.exit()
 
+        files, size = self._check_capacity(files, size)
+
         res = self._run_gum(["confirm", "Vuoi procedere con il backup dei file trovati?"])
         if res.returncode != 0:
             sys.exit()
         
         return files, size
 
+    def _check_capacity(self, files, size):
+        """Capacity plan before copying: FAT32 limit, cluster overhead, categories that do not fit."""
+        if self.mode == "PC":
+            plan = self.engine.plan_backup(files, self.selected_drive, pack_small=self.dest_format == "packed",
+                                           incremental=self.incremental_backup, dedup=self.dest_format == "dedup")
+        else:
+            # Unchanged files of the same phone are linked, not pulled
+            plan = self.android_engine.plan_backup(files, self.selected_drive, incremental=self.incremental_backup)
+
+        print(Fore.WHITE + Style.BRIGHT + "\nSpazio su destinazione:")
+        print(f"  - Occupazione stimata: {plan['estimated'] / (1024*1024):.2f} MB (cluster da {plan['cluster_size'] // 1024} KB)")
+        print(f"  - Spazio libero: {plan['free'] / (1024*1024):.2f} MB")
+        if plan['unchanged']:
+            print(f"  - File invariati dall'ultimo backup (nessuno spazio): {plan['unchanged']}")
+
+        if plan['too_large']:
+            print(Fore.RED + f"\n{len(plan['too_large'])} file superano il limite di 4 GB del FAT32 e verranno saltati:")
+            for f in plan['too_large'][:10]:
+                print(Fore.RED + f"   - {f['source']} ({f['size'] / (1024**3):.2f} GB)")
+            if len(plan['too_large']) > 10:
+                print(Fore.RED + f"   ... e altri {len(plan['too_large']) - 10}")
+
+        if not plan['files']:
+            print(Fore.RED + "\nNessun file entra nella destinazione selezionata.")
+            sys.exit()
+
+        if plan['dropped_categories']:
+            dropped = ", ".join(plan['dropped_categories'])
+            print(Fore.YELLOW + f"\nSpazio insufficiente: per stare nella destinazione vanno escluse le categorie {dropped} ({plan['dropped_files']} file).")
+            res = self._run_gum(["confirm", f"Vuoi procedere escludendo {dropped}?"])
+            if res.returncode != 0:
+                sys.exit()
+
+        if len(plan['files']) != len(files):
+            files = plan['files']
+            size = files.total_size
+            print(Fore.GREEN + f"  - File da copiare: {len(files)} ({size / (1024*1024):.2f} MB)")
+        return files, size
+
     def step4_perform_backup(self, files, total_size):
         self.print_header("Backup in corso")
         dest = self.selected_drive['mountpoint']
@@ -582,15 +704,29 @@ class GumBackupApp:
         pbar = tqdm(total=total_size, unit='B', unit_scale=True, desc="Copia", bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]")
         
         def progress_callback(action, filename, current_copied_size=0):
+            if action == "verifying":
+                # Deferred checks: filename is "checked/total"
+                pbar.set_description(f"Verifica {filename}")
+                return
             delta = current_copied_size - pbar.n
             if delta > 0:
                 pbar.update(delta)
 
         try:
             if self.mode == "PC":
-                count, errors = self.engine.copy_files(files, dest, progress_callback=progress_callback)
+                count, errors = self.engine.copy_files(
+                    files, dest, verify=self.verify_mode, progress_callback=progress_callback,
+                    incremental=self.incremental_backup, dedup=self.dest_format == "dedup",
+                    workers=self.engine.copy_workers, deferred_verify=self.deferred_verify,
+                    pack_small=self.dest_format == "packed", compress=self.compress_mode,
+                    resume=self.resume_backup
+                )
             else:
-                count, errors = self.android_engine.copy_files(files, dest, progress_callback=progress_callback)
+                count, errors = self.android_engine.copy_files(
+                    files, dest, progress_callback=progress_callback,
+                    workers=self.android_engine.copy_workers, transfer=self.android_transfer,
+                    incremental=self.incremental_backup
+                )
                 
             pbar.close()
             
@@ -599,6 +735,11 @@ class GumBackupApp:
             # Use gum style for success message
             self._run_gum(["style", "--foreground", "212", "--border", "rounded", "--align", "center", "--width", "50", f"Backup Completato!\n{count} file copiati."])
             
+            if self.mode == "Android":
+                # Streams that broke and were recovered with adb pull
+                for warning in self.android_engine.copy_stats.get('warnings', []):
+                    print(Fore.YELLOW + warning)
+
             if errors:
                 print(Fore.RED + f"Si sono verificati {len(errors)} errori. Vedi 'backup_errors.log'")
                 with open("backup_errors.log", "w") as f:
@@ -614,13 +755,148 @@ class GumBackupApp:
             else:
                 self.android_engine.stop()
 
+    def step4_perform_streaming_backup(self):
+        self.print_header("Scansione e Backup in corso")
+        dest = self.selected_drive['mountpoint']
+
+        # Total grows while the scan proceeds, so the ETA follows it
+        pbar = tqdm(total=0, unit='B', unit_scale=True, desc="Copia", bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]")
+
+        def progress_callback(action, filename, current_size=0):
+            if action == "scanned":
+                pbar.total = current_size
+                pbar.refresh()
+                return
+            if action == "verifying":
+                pbar.set_description(f"Verifica {filename}")
+                return
+            delta = current_size - pbar.n
+            if delta > 0:
+                pbar.update(delta)
+
+        try:
+            count, errors, found, size = self.engine.stream_backup(
+                self.scan_roots, self.active_category_map, self.custom_extensions, self.exclusions, dest,
+                exceptions=self.exceptions, verify=self.verify_mode, progress_callback=progress_callback,
+                parallel=True, incremental_scan=self.scan_cache, max_per_category=10 if self.test_mode else None,
+                incremental=self.incremental_backup, dedup=self.dest_format == "dedup",
+                workers=self.engine.copy_workers, deferred_verify=self.deferred_verify,
+                pack_small=self.dest_format == "packed", compress=self.compress_mode,
+                resume=self.resume_backup
+            )
+            pbar.close()
+
+            self.print_header("Completato")
+            print(Fore.GREEN + f"Risultati Scansione:")
+            print(f"  - File trovati: {found}")
+            print(f"  - Dimensione totale: {size / (1024*1024):.2f} MB")
+
+            self._run_gum(["style", "--foreground", "212", "--border", "rounded", "--align", "center", "--width", "50", f"Backup Completato!\n{count} file copiati."])
+
+            if errors:
+                print(Fore.RED + f"Si sono verificati {len(errors)} errori. Vedi 'backup_errors.log'")
+                with open("backup_errors.log", "w") as f:
+                    for e in errors: f.write(e + "\n")
+
+            print("\nPremi INVIO per uscire...")
+            input() # simple input to wait
+
+        except KeyboardInterrupt:
+            print(Fore.RED + "\n\nInterrotto!")
+            self.engine.stop()
+
+    def step_restore(self):
+        # Deduplicated archives and incremental snapshots with references
+        # (FAT/exFAT) hold no plain copy of every file: rebuild one here
+        self.step2_select_drive()
+        dest = self.selected_drive['mountpoint']
+        self.print_header("Ripristino")
+
+        snapshots = {}
+        store_root = os.path.join(dest, ObjectStore.DIR_NAME)
+        if os.path.isdir(store_root):
+            for name in ObjectStore(store_root).snapshot_names():
+                snapshots[f"{name} (Archivio deduplicato)"] = ("dedup", name)
+        for name in sorted(os.listdir(dest)):
+            if not name.startswith(("Backup_", "Android_Backup_")):
+                continue
+            if os.path.exists(os.path.join(dest, name, SnapshotManifest.FILE_NAME)):
+                snapshots[f"{name} (Cartella)"] = ("folder", name)
+
+        if not snapshots:
+            print(Fore.RED + "Nessun backup da ripristinare trovato in questa destinazione.")
+            print(Fore.YELLOW + "I backup senza archivio deduplicato né riferimenti contengono già i file così come sono.")
+            print("\nPremi INVIO per uscire...")
+            input()
+            return
+
+        res = self._run_gum(["choose", "--header", "Quale backup vuoi ripristinare?"] + list(reversed(list(snapshots))))
+        selection = res.stdout.strip()
+        if res.returncode != 0 or not selection:
+            sys.exit()
+        kind, name = snapshots[selection]
+
+        print(Fore.CYAN + "Inserisci il percorso della cartella in cui ripristinare i file:")
+        res_input = self._run_gum(["input", "--placeholder", "Es: C:\\Ripristino o /Users/nome/Ripristino"])
+        target = res_input.stdout.strip()
+        if not target:
+            sys.exit()
+        target = os.path.abspath(target)
+        if os.path.isdir(target) and os.listdir(target):
+            res = self._run_gum(["confirm", "--default=false", f"La cartella '{target}' non è vuota: i file con lo stesso nome verranno sovrascritti. Continuare?"])
+            if res.returncode != 0:
+                sys.exit()
+
+        self.print_header("Ripristino in corso")
+        if kind == "dedup":
+            total_size = sum(entry[0] for entry in ObjectStore(store_root).load_tree(name).values())
+        else:
+            snapshot_path = os.path.join(dest, name)
+            total_size = sum(entry[0] for entry in SnapshotManifest.load(snapshot_path).values())
+            for category, container in PackWriter.containers(snapshot_path):
+                total_size += sum(entry['size'] for entry in PackWriter.read_index(container))
+        pbar = tqdm(total=total_size, unit='B', unit_scale=True, desc="Ripristino", bar_format="{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]")
+
+        def progress_callback(action, filename, current_size=0):
+            delta = current_size - pbar.n
+            if delta > 0:
+                pbar.update(delta)
+
+        try:
+            if kind == "dedup":
+                count, errors = self.engine.restore_snapshot(dest, name, target, progress_callback=progress_callback)
+            else:
+                count, errors = self.engine.restore_folder_snapshot(dest, name, target, progress_callback=progress_callback)
+            pbar.close()
+
+            self.print_header("Completato")
+            self._run_gum(["style", "--foreground", "212", "--border", "rounded", "--align", "center", "--width", "50", f"Ripristino Completato!\n{count} file ripristinati."])
+
+            if errors:
+                print(Fore.RED + f"Si sono verificati {len(errors)} errori. Vedi 'backup_errors.log'")
+                with open("backup_errors.log", "w") as f:
+                    for e in errors: f.write(e + "\n")
+
+            print("\nPremi INVIO per uscire...")
+            input() # simple input to wait
+
+        except KeyboardInterrupt:
+            print(Fore.RED + "\n\nInterrotto!")
+            self.engine.stop()
+
     def run(self):
         try:
             self.step_select_mode()
+            if self.mode == "Restore":
+                self.step_restore()
+                return
             self.step1_select_filters()
             self.step2_select_drive()
             files, size = self.step3_scan_and_confirm()
-            self.step4_perform_backup(files, size)
+            if self.stream_mode:
+                self.step4_perform_streaming_backup()
+            else:
+                self.step4_perform_backup(files, size)
         except KeyboardInterrupt:
             print("\nUscita.")
 
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Stand-in for `adb` used by the tests: serves the commands the Android
+engine sends (pull, push, exec-out tar, shell rm) from a local folder.
+
+FAKE_ADB_ROOT      folder holding the device tree ("/sdcard/x" is ROOT/sdcard/x)
+FAKE_ADB_LOG       file every call is appended to
+FAKE_ADB_TAR_LIMIT stop the tar stream after this many files
+FAKE_ADB_NO_TAR    the device has no tar
+"""
+import os
+import re
+import shutil
+import sys
+import tarfile
+
+
+def local(path):
+    return os.path.join(os.environ["FAKE_ADB_ROOT"], path.lstrip("/"))
+
+
+def main(args):
+    log = os.environ.get("FAKE_ADB_LOG")
+    if log:
+        with open(log, "a") as f:
+            f.write(" ".join(args) + "\n")
+    if args[:1] == ["-s"]:
+        args = args[2:]
+
+    if args[0] == "pull":
+        sources, dst = args[1:-1], args[-1]
+        for src in sources:
+            if not os.path.isfile(local(src)):
+                # Like adb: the first failure ends the whole pull
+                sys.stderr.write(f"adb: error: failed to stat remote object '{src}': No such file or directory\n")
+                return 1
+            target = os.path.join(dst, os.path.basename(src)) if os.path.isdir(dst) else dst
+            shutil.copyfile(local(src), target)
+        return 0
+
+    if args[0] == "push":
+        os.makedirs(os.path.dirname(local(args[2])), exist_ok=True)
+        shutil.copyfile(args[1], local(args[2]))
+        return 0
+
+    if args[0] == "exec-out":
+        match = re.match(r"tar -cf - -T (\S+)", args[1])
+        if not match or os.environ.get("FAKE_ADB_NO_TAR"):
+            return 127
+        with open(local(match.group(1))) as f:
+            names = f.read().splitlines()
+        limit = int(os.environ.get("FAKE_ADB_TAR_LIMIT", len(names)))
+        with tarfile.open(fileobj=sys.stdout.buffer, mode="w|") as tar:
+            for name in names[:limit]:
+                if os.path.isfile(local(name)):
+                    tar.add(local(name), arcname=name.lstrip("/"))
+        if limit < len(names):
+            # Broken connection: the archive ends without its trailer
+            sys.stdout.buffer.flush()
+            os._exit(1)
+        return 0
+
+    if args[0] == "shell" and args[1] == "rm":
+        for path in args[3:]:
+            try:
+                os.remove(local(path))
+            except OSError:
+                pass
+        return 0
+
+    sys.stderr.write(f"fake adb: unsupported command {args}\n")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
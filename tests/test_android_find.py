@@ -0,0 +1,65 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backup_engine import AndroidBackupEngine
+
+
+class FindFilterTest(unittest.TestCase):
+    """The device-side find filter agrees with _is_excluded_android."""
+
+    def setUp(self):
+        self.engine = AndroidBackupEngine()
+        self.exclusions = ["Android"]
+        self.exceptions = ["/sdcard/Android/media/com.whatsapp/WhatsApp/Media"]
+
+    def test_long_command_drops_clauses(self):
+        full = self.engine._find_filter(self.exclusions, self.exceptions, {".jpg"})
+        self.assertIn("*Android*", full)
+        self.assertIn("*.jpg", full)
+
+        # Folder and action no longer fit with every clause
+        self.engine.find_command_limit = len(full) + 10
+        short = self.engine._find_filter(self.exclusions, self.exceptions, {".jpg"}, reserved=15)
+        self.assertIn("*Android*", short)
+        self.assertNotIn("*.jpg", short)
+
+        self.engine.find_command_limit = 10
+        minimal = self.engine._find_filter(self.exclusions, self.exceptions, {".jpg"})
+        self.assertNotIn("*Android*", minimal)
+        self.assertTrue(minimal.endswith("-type f"))
+
+    @unittest.skipIf(shutil.which("find") is None or os.name == "nt", "needs a POSIX find")
+    def test_exception_is_a_prefix(self):
+        work = tempfile.mkdtemp(prefix="autobackup_test_")
+        self.addCleanup(shutil.rmtree, work, ignore_errors=True)
+        root = Path(work) / "sdcard"
+        paths = [
+            "Android/media/com.whatsapp/WhatsApp/Media/a.jpg",
+            "Android/media/com.whatsapp/WhatsApp/Media2/b.jpg",
+            "Android/media/com.whatsapp/WhatsApp/Other/c.jpg",
+            "Android/obb/d.jpg",
+            "DCIM/e.jpg",
+        ]
+        for rel in paths:
+            (root / rel).parent.mkdir(parents=True, exist_ok=True)
+            (root / rel).write_bytes(b"x")
+
+        exceptions = [str(root / "Android/media/com.whatsapp/WhatsApp/Media")]
+        find_filter = self.engine._find_filter(self.exclusions, exceptions, {".jpg"})
+        out = subprocess.run(["sh", "-c", f"find '{root}' {find_filter} -print"],
+                             capture_output=True, text=True, check=True).stdout
+        found = sorted(out.splitlines())
+        expected = sorted(str(root / rel) for rel in paths
+                          if not self.engine._is_excluded_android(str(root / rel), self.exclusions, exceptions))
+        self.assertEqual(found, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
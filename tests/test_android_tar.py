@@ -0,0 +1,183 @@
+import errno
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backup_engine import AndroidBackupEngine
+
+FAKE_ADB = str(Path(__file__).resolve().parent / "fake_adb.py")
+
+
+@unittest.skipIf(os.name == "nt", "the fake adb is a POSIX script")
+class AndroidTarTransferTest(unittest.TestCase):
+    """copy_files(transfer="tar") against the fake adb in tests/fake_adb.py."""
+
+    def setUp(self):
+        self.work = Path(tempfile.mkdtemp(prefix="autobackup_test_"))
+        self.device = self.work / "device"
+        self.dest = self.work / "dest"
+        self.dest.mkdir()
+        (self.device / "data" / "local" / "tmp").mkdir(parents=True)
+        self.log = self.work / "adb.log"
+
+        self.files = []
+        for i in range(20):
+            rel = f"DCIM/Camera/img{i}.jpg"
+            path = self.device / "sdcard" / rel
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(os.urandom(1000 + i * 37))
+            self.files.append({'source': f"/sdcard/{rel}", 'size': path.stat().st_size,
+                               'device_id': "FAKE", 'rel_path': rel, 'category': "Immagini"})
+
+        env = {"FAKE_ADB_ROOT": str(self.device), "FAKE_ADB_LOG": str(self.log)}
+        patcher = mock.patch.dict(os.environ, env)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.work, ignore_errors=True)
+
+        self.engine = AndroidBackupEngine()
+        self.engine.adb_exe = FAKE_ADB
+
+    def backup_dir(self):
+        dirs = [d for d in self.dest.iterdir() if d.name.startswith("Android_Backup_")]
+        self.assertEqual(len(dirs), 1)
+        return dirs[0]
+
+    def calls(self, command):
+        return [line for line in self.log.read_text().splitlines() if f" {command} " in line]
+
+    def assert_copied(self, files):
+        backup = self.backup_dir()
+        for file_info in files:
+            expected = (self.device / file_info['source'].lstrip("/")).read_bytes()
+            self.assertEqual((backup / file_info['rel_path']).read_bytes(), expected)
+        self.assertEqual(list(backup.rglob("*.autobackup.part")), [])
+
+    def test_stream_copies_everything_without_pull(self):
+        copied, errors = self.engine.copy_files(self.files, str(self.dest), transfer="tar")
+
+        self.assertEqual((copied, errors), (len(self.files), []))
+        self.assert_copied(self.files)
+        self.assertEqual(self.calls("pull"), [])
+        # The file list pushed to the device is removed afterwards
+        self.assertEqual(os.listdir(self.device / "data" / "local" / "tmp"), [])
+
+    def test_broken_stream_falls_back_to_pull(self):
+        with mock.patch.dict(os.environ, {"FAKE_ADB_TAR_LIMIT": "5"}):
+            copied, errors = self.engine.copy_files(self.files, str(self.dest), transfer="tar")
+
+        self.assertEqual(copied, len(self.files))
+        self.assert_copied(self.files)
+        self.assertNotEqual(self.calls("pull"), [])
+        self.assertEqual(errors, [])
+        warnings = self.engine.copy_stats['warnings']
+        self.assertNotEqual(warnings, [])
+        self.assertTrue(all(w.startswith("Error streaming from FAKE") for w in warnings))
+
+    def test_device_without_tar_falls_back_to_pull(self):
+        with mock.patch.dict(os.environ, {"FAKE_ADB_NO_TAR": "1"}):
+            copied, errors = self.engine.copy_files(self.files, str(self.dest), transfer="tar")
+
+        self.assertEqual(copied, len(self.files))
+        self.assert_copied(self.files)
+
+    def test_missing_file_is_reported(self):
+        missing = {'source': "/sdcard/DCIM/Camera/gone.jpg", 'size': 10,
+                   'device_id': "FAKE", 'rel_path': "DCIM/Camera/gone.jpg"}
+        copied, errors = self.engine.copy_files(self.files + [missing], str(self.dest), transfer="tar")
+
+        self.assertEqual(copied, len(self.files))
+        self.assert_copied(self.files)
+        self.assertTrue(any(missing['source'] in e for e in errors))
+
+    def test_destination_write_error_is_reported(self):
+        real_open = open
+
+        def failing_open(file, mode="r", *args, **kwargs):
+            if "w" in mode and str(file).endswith("img3.jpg.autobackup.part"):
+                raise PermissionError(13, "Permission denied", str(file))
+            return real_open(file, mode, *args, **kwargs)
+
+        with mock.patch("builtins.open", failing_open):
+            copied, errors = self.engine.copy_files(self.files, str(self.dest), transfer="tar")
+
+        self.assertEqual(copied, len(self.files) - 1)
+        self.assertEqual(len(errors), 1)
+        self.assertIn("img3.jpg", errors[0])
+        self.assertIn("Permission denied", errors[0])
+        self.assert_copied(f for f in self.files if not f['source'].endswith("img3.jpg"))
+
+    def test_full_destination_stops_the_transfer(self):
+        real_open = open
+
+        def full_open(file, mode="r", *args, **kwargs):
+            if "w" in mode and str(file).endswith("img3.jpg.autobackup.part"):
+                raise OSError(errno.ENOSPC, "No space left on device", str(file))
+            return real_open(file, mode, *args, **kwargs)
+
+        with mock.patch("builtins.open", full_open):
+            copied, errors = self.engine.copy_files(self.files, str(self.dest), transfer="tar")
+
+        self.assertEqual(copied + len(errors), len(self.files))
+        self.assertTrue(all("No space left on device" in e for e in errors))
+        self.assertEqual(self.calls("pull"), [])
+
+    def test_partial_pull_batch_counts_pulled_bytes(self):
+        missing = {'source': "/sdcard/DCIM/Camera/gone.jpg", 'size': 10 ** 6,
+                   'device_id': "FAKE", 'rel_path': "DCIM/Camera/gone.jpg"}
+        progress = []
+        copied, errors = self.engine.copy_files(
+            self.files + [missing], str(self.dest), transfer="pull", workers=2,
+            progress_callback=lambda action, name, size=0: progress.append(size))
+
+        self.assertEqual(copied, len(self.files))
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(progress[-1], sum(f['size'] for f in self.files))
+
+    def test_failed_file_does_not_lose_the_rest_of_its_batch(self):
+        missing = {'source': "/sdcard/DCIM/Camera/gone.jpg", 'size': 10, 'device_id': "FAKE",
+                   'rel_path': "DCIM/Camera/gone.jpg", 'category': "Immagini"}
+        files = self.files[:5] + [missing] + self.files[5:]
+        copied, errors = self.engine.copy_files(files, str(self.dest), transfer="pull")
+
+        self.assertEqual(copied, len(self.files))
+        self.assert_copied(self.files)
+        self.assertEqual(len(errors), 1)
+        self.assertIn("gone.jpg", errors[0])
+        self.assertIn("failed to stat remote object", errors[0])
+        # One batch, then the files after the failure one at a time
+        self.assertEqual(len(self.calls("pull")), 1 + 1 + len(self.files) - 5)
+
+    def test_incremental_links_only_the_same_device(self):
+        for file_info in self.files:
+            file_info['mtime_ns'] = 1700000000 * 10**9
+        other = [dict(f, device_id="OTHER") for f in self.files]
+        self.engine.copy_files(other, str(self.dest), transfer="pull")
+        time.sleep(1.1)  # snapshot folders are named by the second
+
+        plan = self.engine.plan_backup(self.files, {'mountpoint': str(self.dest), 'free': 10 ** 12},
+                                       incremental=True)
+        self.assertEqual(plan['unchanged'], 0)
+        copied, errors = self.engine.copy_files(self.files, str(self.dest), transfer="pull", incremental=True)
+        self.assertEqual((copied, errors), (len(self.files), []))
+        self.assertEqual(self.engine.copy_stats['linked'] + self.engine.copy_stats['referenced'], 0)
+        time.sleep(1.1)
+
+        plan = self.engine.plan_backup(self.files, {'mountpoint': str(self.dest), 'free': 10 ** 12},
+                                       incremental=True)
+        self.assertEqual(plan['unchanged'], len(self.files))
+        log_size = len(self.calls("pull"))
+        copied, errors = self.engine.copy_files(self.files, str(self.dest), transfer="pull", incremental=True)
+        self.assertEqual((copied, errors), (len(self.files), []))
+        self.assertEqual(len(self.calls("pull")), log_size)
+
+
+if __name__ == "__main__":
+    unittest.main()